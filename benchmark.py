@@ -0,0 +1,366 @@
+"""Mesures de performance des chemins critiques de la peinture, sans écran
+
+Usage :
+    python benchmark.py                    # mesurer et comparer à la référence si elle existe
+    python benchmark.py --save-baseline    # enregistrer les mesures comme nouvelle référence
+
+Chaque cas tourne dans un processus neuf et rapporte p50/p95/p99 (ms) et le pic de mémoire résidente
+de ce processus (tampons de Pillow compris). Le programme se termine en erreur si le p95 d'un cas
+dépasse celui de la référence de plus de la tolérance.
+"""
+
+import argparse
+import shutil
+import tempfile
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from PIL import Image
+
+from spray_engine import SprayEngine, AssetCache
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows : pas de pic mémoire résidente
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+# Paliers de l'application, définis pour 1920x1080
+SIZE_LEVELS = (20, 60, 100, 140, 180, 220)
+SPRAY_OPACITY = 100
+SPRAY_COLOR = "#E74C3C"
+
+
+def image_path(folder):
+    """Première image du dossier, None si le dossier est vide"""
+    directory = os.path.join(BASE_DIR, folder)
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")):
+                return os.path.join(directory, name)
+    return None
+
+
+def load_image(folder, fallback_size):
+    """Première image du dossier, ou une image de bruit si le dossier est vide"""
+    path = image_path(folder)
+    if path:
+        return Image.open(path).convert("RGBA")
+    noise = np.random.default_rng(0).integers(0, 256, (fallback_size[1], fallback_size[0], 4), dtype=np.uint8)
+    return Image.fromarray(noise, "RGBA")
+
+
+def new_engine(size):
+    engine = SprayEngine(size, seed=0)
+    # Banques de jets calculées avant les mesures, comme après le préchauffage au démarrage
+    for level in SIZE_LEVELS:
+        engine.brush.stamps.get(engine.scaled(level), SPRAY_OPACITY)
+        engine.get_eraser_mask(engine.scaled(level))
+    return engine
+
+
+def measure(function, repeat, setup=None):
+    """Durées (ms) de repeat appels"""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        function(argument)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def peak_rss_kb():
+    """Pic de mémoire résidente du processus (Ko), None si inconnu"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # Octets sous macOS, Ko ailleurs
+
+
+def bench_dabs(size, repeat, level, eraser=False):
+    """Un jet par appel : les positions sont espacées exactement de l'espacement des jets"""
+    engine = new_engine(size)
+    state = {"size": engine.scaled(level)}
+
+    def setup():
+        if "stroke" not in state or state["x"] > size[0] - 200:
+            if "stroke" in state:
+                engine.end_stroke()
+            state["y"] = 200 + (state.get("y", 0) + 97) % (size[1] - 400)
+            state["x"] = 200
+            state["stroke"] = engine.begin_stroke(state["x"], state["y"], SPRAY_COLOR, state["size"],
+                                                  SPRAY_OPACITY, eraser=eraser)
+            if eraser:
+                # Le dessin à effacer est ajouté hors mesure
+                engine.draw_dabs(engine.drawing_layer, [(x, state["y"]) for x in range(200, size[0] - 200, 40)],
+                                 False, (0, 0, 0), state["size"], SPRAY_OPACITY)
+        state["x"] += state["stroke"]["spacing"]
+
+    def run(_):
+        engine.add_point(state["x"], state["y"])
+
+    with engine.layer_lock:
+        timings = measure(run, repeat, setup)
+        engine.end_stroke()
+    return timings
+
+
+def bench_frame(size, repeat):
+    """Une image à 60 Hz : 5 positions du stylet espacées de 12 px, taille 100"""
+    engine = new_engine(size)
+    state = {"x": 200, "y": 300}
+    engine.begin_stroke(state["x"], state["y"], SPRAY_COLOR, engine.scaled(100), SPRAY_OPACITY)
+
+    def run(_):
+        points = []
+        for _ in range(5):
+            state["x"] += 12
+            if state["x"] > size[0] - 200:
+                state["x"], state["y"] = 200, 200 + (state["y"] + 83) % (size[1] - 400)
+            points.append((state["x"], state["y"], 0))
+        engine.add_points(points)
+
+    return measure(run, repeat)
+
+
+def bench_reload_background(size, repeat):
+    """Changement de fond puis recomposition de tout l'écran (reload_background_layers)"""
+    engine = new_engine(size)
+    background = load_image("fonds", size)
+    target = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+
+    def run(_):
+        engine.set_background(background)
+        engine.render_region((0, 0) + size, target)
+
+    return measure(run, repeat)
+
+
+def bench_decode_background(size, repeat, cached=False):
+    """Décodage d'un fichier de fond à la taille du canvas (load_background), sans cache ou depuis le cache"""
+    engine = new_engine(size)
+    directory = tempfile.mkdtemp()
+    path = image_path("fonds")
+    if path is None:
+        path = os.path.join(directory, "fond.jpg")
+        load_image("fonds", (4000, 3000)).convert("RGB").save(path, quality=90)
+    cache = AssetCache(os.path.join(directory, "cache"))
+    try:
+        if not cached:
+            return measure(lambda _: engine.decode_background(path), repeat)
+        engine.decode_background(path, cache)
+        return measure(lambda _: engine.decode_background(path, cache), repeat)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_history(size, repeat, step):
+    """Historique selon step : début de trait (save_state, premier jet compris), fin de trait (image de
+    l'historique prise au lever du stylet) ou annulation d'un trait"""
+    engine = new_engine(size)
+    rng = np.random.default_rng(1)
+
+    def begin_stroke():
+        x, y = rng.integers(200, size[0] - 600), rng.integers(200, size[1] - 200)
+        engine.begin_stroke(x, y, SPRAY_COLOR, engine.scaled(100), SPRAY_OPACITY)
+        for i in range(1, 10):
+            engine.add_points([(x + i * 40, y + i * 5, 0)])
+
+    def stroke():
+        begin_stroke()
+        engine.end_stroke()
+
+    for _ in range(15):
+        stroke()
+
+    def run_begin(_):
+        engine.begin_stroke(300, 300, SPRAY_COLOR, engine.scaled(100), SPRAY_OPACITY)
+        engine.add_point(340, 300)
+
+    if step == "debut":
+        return measure(run_begin, repeat, setup=engine.end_stroke)
+    if step == "fin":
+        return measure(lambda _: engine.end_stroke(), repeat, setup=begin_stroke)
+    return measure(lambda _: engine.undo(), repeat, setup=stroke)
+
+
+def bench_template(size, repeat, mode):
+    """Suppression du fond d'un modèle (load_template), selon mode : couleur des coins, remplissage depuis les coins, cache"""
+    engine = new_engine(size)
+    template = load_image("modeles", (1000, 1000))
+    directory = tempfile.mkdtemp()
+    path = image_path("modeles")
+    if path is None:
+        path = os.path.join(directory, "modele.png")
+        template.save(path)
+    cache = AssetCache(os.path.join(directory, "cache"))
+    try:
+        if mode == "couleur":
+            return measure(lambda _: engine.extract_template(template), repeat)
+        if mode == "remplissage":
+            return measure(lambda _: engine.extract_template(template, flood_fill=True), repeat)
+        engine.decode_template(path, cache)
+        return measure(lambda _: engine.decode_template(path, cache), repeat)
+    finally:
+        shutil.rmtree(directory)
+
+
+def save_engine(size):
+    engine = new_engine(size)
+    engine.set_background(load_image("fonds", size))
+    engine.begin_stroke(200, 200, SPRAY_COLOR, engine.scaled(100), SPRAY_OPACITY)
+    for i in range(1, 40):
+        engine.add_points([(200 + i * 30, 200 + i * 15, 0)])
+    engine.end_stroke()
+    return engine
+
+
+def bench_save(size, repeat, extension, png_compression=6):
+    """Composition par bandes de l'image complète et encodage (thread de sauvegarde de save_image)"""
+    engine = save_engine(size)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "image" + extension)
+
+    def run(_):
+        image = engine.compose_snapshot(engine.snapshot(), band_height=64).convert("RGB")
+        engine.save_image(image, path, png_compression)
+
+    try:
+        return measure(run, repeat)
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+
+
+def bench_snapshot(size, repeat):
+    """Instantané des couches, seule partie de la sauvegarde faite par l'interface"""
+    engine = save_engine(size)
+    engine.get_base_layer()
+    return measure(lambda _: engine.snapshot(), repeat)
+
+
+def percentiles(timings):
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+def suite_cases(size, repeat):
+    """Cas mesurés, dans l'ordre d'affichage : {nom: fonction sans argument retournant les durées}"""
+    cases = {}
+    for level in SIZE_LEVELS:
+        cases[f"dab_size_{level}"] = lambda level=level: bench_dabs(size, repeat * 4, level)
+    for level in SIZE_LEVELS:
+        cases[f"eraser_size_{level}"] = lambda level=level: bench_dabs(size, repeat * 4, level, eraser=True)
+    cases["frame_5_points"] = lambda: bench_frame(size, repeat * 4)
+    cases["reload_background"] = lambda: bench_reload_background(size, max(repeat // 4, 3))
+    cases["decode_background"] = lambda: bench_decode_background(size, max(repeat // 4, 3))
+    cases["decode_background_cached"] = lambda: bench_decode_background(size, max(repeat // 4, 3), cached=True)
+    cases["save_state"] = lambda: bench_history(size, max(repeat // 2, 5), "debut")
+    cases["stroke_end"] = lambda: bench_history(size, max(repeat // 2, 5), "fin")
+    cases["undo"] = lambda: bench_history(size, max(repeat // 2, 5), "annulation")
+    cases["template_removal"] = lambda: bench_template(size, max(repeat // 4, 3), "couleur")
+    cases["template_removal_flood"] = lambda: bench_template(size, max(repeat // 4, 3), "remplissage")
+    cases["template_cached"] = lambda: bench_template(size, max(repeat // 4, 3), "cache")
+    cases["save_snapshot"] = lambda: bench_snapshot(size, repeat)
+    cases["save_png"] = lambda: bench_save(size, max(repeat // 8, 3), ".png")
+    cases["save_png_fast"] = lambda: bench_save(size, max(repeat // 8, 3), ".png", png_compression=1)
+    cases["save_webp_lossless"] = lambda: bench_save(size, max(repeat // 8, 3), ".webp")
+    cases["save_jpeg"] = lambda: bench_save(size, max(repeat // 4, 3), ".jpg")
+    return cases
+
+
+def run_case(name, size, repeat):
+    """Mesurer un seul cas (processus enfant) et écrire ses durées et son pic mémoire en JSON"""
+    timings = suite_cases(size, repeat)[name]()
+    print(json.dumps({"timings": timings, "peak_rss_kb": peak_rss_kb()}))
+
+
+def run_suite(size, repeat):
+    """Exécuter chaque cas dans un processus neuf, retourne {nom: {p50, p95, p99, peak_rss_kb, samples}}
+
+    Le pic de mémoire résidente d'un cas compte l'interpréteur, NumPy, Pillow et la préparation du cas :
+    il se compare d'une exécution à l'autre, pas comme la mémoire propre à l'opération mesurée.
+    """
+    results = {}
+    for name in suite_cases(size, repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", name,
+                                 "--size", f"{size[0]}x{size[1]}", "--repeat", str(repeat)],
+                                stdout=subprocess.PIPE, text=True, check=True).stdout
+        measured = json.loads(output.strip().splitlines()[-1])
+        results[name] = dict(percentiles(measured["timings"]), peak_rss_kb=measured["peak_rss_kb"],
+                             samples=len(measured["timings"]))
+        r = results[name]
+        peak = f"{r['peak_rss_kb'] // 1024:>6} Mo" if r["peak_rss_kb"] is not None else "     ? Mo"
+        print(f"{name:<24} p50 {r['p50']:>9.3f}  p95 {r['p95']:>9.3f}  p99 {r['p99']:>9.3f} ms  RSS max {peak}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Cas dont le p95 dépasse celui de la référence de plus de tolerance (fraction)"""
+    regressions = []
+    for name, reference in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current and current["p95"] > reference["p95"] * (1 + tolerance):
+            regressions.append((name, reference["p95"], current["p95"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesures de performance du moteur de peinture")
+    parser.add_argument("--size", default="1920x1080", help="taille du canvas, ex. 3840x2160")
+    parser.add_argument("--repeat", type=int, default=40, help="nombre de mesures par cas (multiplié pour les jets)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="fichier JSON de référence")
+    parser.add_argument("--save-baseline", action="store_true", help="enregistrer les mesures comme référence")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="hausse du p95 tolérée (0.25 = 25%%)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)  # Processus enfant : un seul cas
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+    if args.case:
+        run_case(args.case, size, args.repeat)
+        return 0
+
+    print(f"Mesures sur un canvas {size[0]}x{size[1]} ({platform.python_implementation()} "
+          f"{platform.python_version()}, {platform.machine()})\n")
+    results = run_suite(size, args.repeat)
+    print()
+
+    report = {"size": list(size), "platform": platform.platform(), "results": results}
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Référence enregistrée : {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Pas de référence (lancer avec --save-baseline pour en créer une)")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("size") != list(size):
+        print(f"Référence mesurée en {baseline.get('size')}, comparaison ignorée")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("Régressions (p95) :")
+        for name, reference, current in regressions:
+            print(f"  {name}: {reference:.3f} ms -> {current:.3f} ms")
+        return 1
+    print("Aucune régression par rapport à la référence")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1406 @@
+"""Moteur de peinture au spray, indépendant de Qt
+
+Contient le pinceau (particules, banques de jets), l'historique rejouable et SprayEngine,
+qui possède les couches et expose begin_stroke/add_point/end_stroke/render_region.
+"""
+
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+class RandomPool:
+    """Réserves de tirages aléatoires pré-calculés, en anneaux remplis en bloc par le Generator NumPy
+
+    Les jets ne font que prélever des tranches : pas d'appel au générateur dans la boucle de dessin.
+    """
+
+    # Mélange du spray : 50% centre, 35% intermédiaire, 15% projections (écart-type relatif à la taille)
+    MIXTURE_WEIGHTS = (0.5, 0.35, 0.15)
+    MIXTURE_SCALES = (1 / 3.5, 1 / 1.8, 1.5)
+
+    def __init__(self, seed=None, pool_size=1 << 16):
+        self.pool_size = pool_size
+        self.reseed(seed)
+
+    def reseed(self, seed):
+        """Repartir d'une graine : vider les réserves pour que les tirages suivants soient reproductibles"""
+        self.rng = np.random.default_rng(seed)
+        self.buffers = {}
+        self.positions = {}
+
+    def fill(self, kind, count):
+        """Tirer count nouvelles valeurs d'une réserve"""
+        if kind == 'mixture':
+            zone = self.rng.random(count)
+            first, second, _ = self.MIXTURE_WEIGHTS
+            scale = np.where(zone < first, self.MIXTURE_SCALES[0],
+                             np.where(zone < first + second, self.MIXTURE_SCALES[1], self.MIXTURE_SCALES[2]))
+            return (self.rng.standard_normal((count, 2)) * scale[:, None]).astype(np.float32)
+        return self.rng.random(count, dtype=np.float32)
+
+    def take(self, kind, count):
+        """Prélever les count valeurs suivantes d'une réserve, remplie en bloc quand elle est épuisée"""
+        buffer = self.buffers.get(kind)
+        position = self.positions.get(kind, 0)
+        if buffer is None or position + count > len(buffer):
+            fresh = self.fill(kind, max(self.pool_size, count))
+            buffer = fresh if buffer is None else np.concatenate([buffer[position:], fresh])
+            self.buffers[kind] = buffer
+            position = 0
+        self.positions[kind] = position + count
+        return buffer[position:position + count]
+
+    def mixture_offsets(self, count):
+        """Décalages (x, y) du mélange à 3 zones, en unités de la taille du spray"""
+        return self.take('mixture', count)
+
+    def uniform(self, count):
+        """Valeurs uniformes dans [0, 1)"""
+        return self.take('uniform', count)
+
+
+class SprayBrush:
+    """Générateur de particules vectorisé (NumPy) pour le spray"""
+
+    # Côté des tuiles composées sur la couche : seules celles touchées par un lot sont recopiées
+    TILE_SIZE = 256
+
+    # Rayons possibles des particules : 0.5, 1, puis 1.5 à 2.5 par pas de 0.25
+    PARTICLE_RADII = (0.5, 1.0, 1.5, 1.75, 2.0, 2.25, 2.5)
+
+    def __init__(self, seed=None, scale=1.0):
+        self.pool = RandomPool(seed)
+        self.scale = scale  # Échelle de l'écran : un jet à l'échelle garde la même couverture
+        self._build_footprints()
+        self.stamps = StampCache(self)
+
+    def reseed(self, seed):
+        """Repartir d'une graine : les mêmes jets redonnent alors les mêmes particules"""
+        self.pool.reseed(seed)
+
+    def _build_footprints(self):
+        """Pré-calculer l'empreinte en pixels de chaque rayon (identique à ImageDraw.ellipse)
+
+        Les rayons suivent l'échelle de l'écran (sans descendre sous 0.5px) : le jet mis à l'échelle
+        garde son nombre de particules et couvre la même part de sa surface qu'en 1920x1080.
+        """
+        radii = [max(0.5, radius * self.scale) for radius in self.PARTICLE_RADII]
+        center = max(5, math.ceil(max(radii)) + 2)
+        lengths = []
+        offsets = []
+        for radius in radii:
+            mask = Image.new('L', (2 * center + 1, 2 * center + 1), 0)
+            ImageDraw.Draw(mask).ellipse([center - radius, center - radius, center + radius, center + radius],
+                                         fill=255)
+            ys, xs = np.nonzero(np.array(mask))
+            offsets.append((xs - center, ys - center))
+            lengths.append(len(xs))
+
+        # Tables remplies pour un accès vectorisé : footprint_dx[k, j]
+        max_len = max(lengths)
+        self.footprint_len = np.array(lengths)
+        self.footprint_reach = int(max(np.abs(dx).max(initial=0) for dx, _ in offsets))  # Rayon maximal en pixels
+        self.footprint_dx = np.zeros((len(offsets), max_len), dtype=np.int32)
+        self.footprint_dy = np.zeros((len(offsets), max_len), dtype=np.int32)
+        for k, (dx, dy) in enumerate(offsets):
+            self.footprint_dx[k, :len(dx)] = dx
+            self.footprint_dy[k, :len(dy)] = dy
+
+    def generate(self, x, y, spray_size, spray_opacity, pool=None):
+        """Tirer toutes les particules d'un jet en une seule fois
+
+        Retourne (xs, ys, kinds, alphas) : centres, indice de rayon et opacité (0-255).
+        """
+        pool = self.pool if pool is None else pool
+        num_particles = int(spray_size * 6)
+
+        # Distribution en 3 zones : 50% centre, 35% intermédiaire, 15% projections
+        offsets = np.trunc(pool.mixture_offsets(num_particles) * spray_size).astype(np.int32)
+        offset_x, offset_y = offsets[:, 0], offsets[:, 1]
+
+        distance = np.sqrt(offset_x.astype(np.float64) ** 2 + offset_y.astype(np.float64) ** 2)
+        keep = distance <= spray_size * 2
+        offset_x, offset_y, distance = offset_x[keep], offset_y[keep], distance[keep]
+        count = len(distance)
+
+        # Tailles : 75% de 0.5px, 17% de 1px, 8% entre 1.5px et 2.5px
+        size_rand = pool.uniform(count)
+        medium = 2 + np.rint(pool.uniform(count) * 4).astype(np.int32)
+        kinds = np.where(size_rand < 0.75, 0, np.where(size_rand < 0.92, 1, medium))
+
+        # Opacité selon la distance, avec une courbe douce
+        jitter = pool.uniform(count).astype(np.float64)
+        center_opacity = 0.6 + jitter * 0.3
+        middle_opacity = np.clip(1 - distance / spray_size, 0, None) ** 1.5 * (0.4 + jitter * 0.5)
+        far_opacity = np.clip(1 - distance / (spray_size * 2), 0, None) ** 3 * (0.1 + jitter * 0.3)
+        base_opacity = np.where(distance < spray_size * 0.3, center_opacity,
+                                np.where(distance < spray_size, middle_opacity, far_opacity))
+
+        alphas = (255 * base_opacity * (spray_opacity / 100.0)).astype(np.int32)
+        alphas = np.minimum(alphas, 200)
+
+        return x + offset_x, y + offset_y, kinds, alphas
+
+    def build_stamp(self, particles):
+        """Développer les particules d'un jet centré en (0, 0) en masque alpha creux
+
+        Retourne (dx, dy, transparence) : une seule entrée par pixel, la dernière particule
+        qui le couvre l'emportant (comme avec ImageDraw), et 1 - alpha en float32.
+        """
+        xs, ys, kinds, alphas = particles
+        lengths = self.footprint_len[kinds]
+        owner = np.repeat(np.arange(len(xs)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        slot = np.arange(len(owner)) - np.repeat(starts, lengths)
+        dx = xs[owner] + self.footprint_dx[kinds[owner], slot]
+        dy = ys[owner] + self.footprint_dy[kinds[owner], slot]
+        alpha = alphas[owner]
+
+        span = int(np.abs(dx).max(initial=0)) * 2 + 1
+        flat = dy * span + dx
+        _, last = np.unique(flat[::-1], return_index=True)
+        last = len(flat) - 1 - last
+        return (dx[last].astype(np.int32), dy[last].astype(np.int32),
+                (1 - alpha[last] / 255.0).astype(np.float32))
+
+    def pick_stamps(self, count, spray_size, spray_opacity):
+        """Choisir au hasard count jets pré-calculés pour cette taille et cette opacité"""
+        bank = self.stamps.get(spray_size, spray_opacity)
+        choices = (self.pool.uniform(count) * len(bank)).astype(np.int32)
+        return [bank[min(i, len(bank) - 1)] for i in choices]
+
+    def splat(self, layer, dabs, rgb_color):
+        """Appliquer un lot de jets [(x, y, stamp)] sur la couche avec une seule composition
+
+        Retourne la liste des boîtes (x0, y0, x1, y1) des tuiles modifiées (vide si rien n'a été dessiné).
+        """
+        width, height = layer.size
+        pixels = []
+        for x, y, (dx, dy, transparency) in dabs:
+            px, py = x + dx, y + dy
+            inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            if inside.any():
+                pixels.append((px[inside], py[inside], transparency[inside]))
+        if not pixels:
+            return []
+
+        x0 = min(int(px.min()) for px, _, _ in pixels)
+        y0 = min(int(py.min()) for _, py, _ in pixels)
+        x1 = max(int(px.max()) for px, _, _ in pixels) + 1
+        y1 = max(int(py.max()) for _, py, _ in pixels) + 1
+
+        # Tous les jets du lot ont la même couleur : les composer "par-dessus" les uns les autres
+        # revient à multiplier leurs transparences, la couleur n'est appliquée qu'à la fin
+        region_transparency = np.ones((y1 - y0, x1 - x0), dtype=np.float32)
+        for px, py, transparency in pixels:
+            region_transparency[py - y0, px - x0] *= transparency
+        region_alpha = np.rint((1 - region_transparency) * 255).astype(np.uint8)
+
+        # Composer tuile par tuile, uniquement celles qui ont reçu des particules :
+        # un trait rapide en diagonale ne recopie pas toute sa boîte englobante
+        tile = self.TILE_SIZE
+        all_px = np.concatenate([px for px, _, _ in pixels])
+        all_py = np.concatenate([py for _, py, _ in pixels])
+        touched = np.unique((all_py // tile) * (width // tile + 1) + all_px // tile)
+        boxes = []
+        for key in touched:
+            ty, tx = divmod(int(key), width // tile + 1)
+            tx0, ty0 = max(tx * tile, x0), max(ty * tile, y0)
+            tx1, ty1 = min((tx + 1) * tile, x1), min((ty + 1) * tile, y1)
+            tinted = np.empty((ty1 - ty0, tx1 - tx0, 4), dtype=np.uint8)
+            tinted[:, :, :3] = rgb_color
+            tinted[:, :, 3] = region_alpha[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0]
+            layer.alpha_composite(Image.fromarray(tinted, 'RGBA'), dest=(tx0, ty0))
+            boxes.append((tx0, ty0, tx1, ty1))
+        return boxes
+
+
+class StampCache:
+    """Banques de jets pré-calculés par (taille, opacité), en masques alpha, avec éviction LRU
+
+    Chaque banque est tirée avec une graine dérivée de sa clé : un trait rejoué retrouve
+    les mêmes jets, que la banque ait été préchauffée ou recalculée entre-temps.
+    """
+
+    def __init__(self, brush, bank_size=32, max_entries=36):
+        self.brush = brush
+        self.bank_size = bank_size
+        self.max_entries = max_entries  # 6 tailles x 6 opacités
+        self.banks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, spray_size, spray_opacity):
+        """Banque de jets pour cette taille et cette opacité, calculée au premier besoin"""
+        key = (spray_size, spray_opacity)
+        with self.lock:
+            bank = self.banks.get(key)
+            if bank is not None:
+                self.banks.move_to_end(key)
+                return bank
+
+        pool = RandomPool(key)
+        bank = [self.brush.build_stamp(self.brush.generate(0, 0, spray_size, spray_opacity, pool))
+                for _ in range(self.bank_size)]
+        with self.lock:
+            self.banks[key] = bank
+            self.banks.move_to_end(key)
+            while len(self.banks) > self.max_entries:
+                self.banks.popitem(last=False)
+        return bank
+
+    def warm(self, keys):
+        """Précalculer en arrière-plan les banques des (taille, opacité) données, dans l'ordre"""
+        def run():
+            for spray_size, spray_opacity in keys:
+                self.get(spray_size, spray_opacity)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+class StrokeHistory:
+    """Historique annuler/rétablir sous forme de journal de commandes rejouables
+
+    Chaque trait est gardé comme une commande compacte (positions, paramètres, graine du
+    générateur) plutôt que comme des pixels. Une image de la couche, compressée tuile par tuile
+    par un thread à part, est gardée toutes les checkpoint_interval commandes : seules les tuiles
+    modifiées depuis la précédente (signalées par mark_changed) sont recompressées, les autres sont
+    partagées. Annuler ne décompresse que les tuiles de la zone annulée et n'y rejoue que les jets
+    des commandes suivantes qui la touchent. Les tuiles des dernières images restent aussi gardées
+    décompressées (decoded_tiles au plus) : annuler un trait récent n'a alors rien à décompresser.
+
+    On peut annuler au plus max_entries commandes. La mémoire est libérée par image entière
+    (l'image la plus ancienne et ses commandes) : l'historique peut dépasser max_bytes d'au
+    plus une image et checkpoint_interval commandes.
+    """
+
+    # Compression des tuiles, hors du thread de rendu (zlib libère le GIL)
+    compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='historique')
+
+    def __init__(self, replay, max_entries=50, max_bytes=256 * 1024 * 1024, checkpoint_interval=1,
+                 tile_size=SprayBrush.TILE_SIZE, decoded_tiles=64):
+        self.replay = replay  # replay(layer, command, clip) : rejouer une commande sur une couche, dans clip
+        self.tile_size = tile_size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.checkpoint_interval = checkpoint_interval
+        # Les commandes au-delà de position sont celles qui peuvent être rétablies
+        self.commands = []
+        self.base = 0  # Indice absolu de commands[0]
+        self.position = 0
+        # Images de la couche par indice absolu : (taille, {(tx, ty): Future des octets zlib des tuiles non vides})
+        self.checkpoints = {}
+        # Tuiles décompressées les plus récentes : id de la tuile -> (tuile, octets RGBA)
+        self.decoded = OrderedDict()
+        self.decoded_tiles = decoded_tiles
+        # Tuiles modifiées depuis l'image prise à l'indice changed_since
+        self.changed_tiles = set()
+        self.changed_since = None
+
+    def begin(self, layer, command):
+        """Ajouter une commande (thread de rendu), après avoir pris une image si nécessaire"""
+        # Un trait sans aucun jet ne compte pas comme une action
+        if self.position > self.base and not self.commands[self.position - self.base - 1]['box']:
+            self.position -= 1
+        del self.commands[self.position - self.base:]
+        for index in [i for i in self.checkpoints if i > self.position]:
+            del self.checkpoints[index]
+
+        if self.checkpoint_due():
+            self.add_checkpoint(layer)
+        self.commands.append(command)
+        self.position += 1
+        self.enforce_budget()
+
+    def end(self, layer):
+        """Fin de la commande en cours (thread de rendu) : l'image due est prise maintenant, stylet levé,
+        plutôt qu'au début du trait suivant"""
+        if self.position > self.base and self.commands[self.position - self.base - 1]['box'] and \
+                self.checkpoint_due():
+            self.add_checkpoint(layer)
+            self.enforce_budget()
+
+    def checkpoint_due(self):
+        return not self.checkpoints or self.position - max(self.checkpoints) >= self.checkpoint_interval
+
+    def add_checkpoint(self, layer):
+        self.checkpoints[self.position] = self.take_checkpoint(layer)
+        self.changed_tiles = set()
+        self.changed_since = self.position
+
+    def tile_box(self, size, tx, ty):
+        tile = self.tile_size
+        return (tx * tile, ty * tile, min((tx + 1) * tile, size[0]), min((ty + 1) * tile, size[1]))
+
+    def mark_changed(self, tiles):
+        """Noter des tuiles (tx, ty) de la couche modifiées (trait, annulation, effacement)"""
+        self.changed_tiles.update(tiles)
+
+    def take_checkpoint(self, layer):
+        """Image compressée de la couche, tuile par tuile (les tuiles vides ne sont pas gardées)
+
+        Les tuiles non modifiées depuis la dernière image sont reprises telles quelles ; après une
+        annulation au-delà de celle-ci, toute la couche est recompressée.
+        """
+        latest = max(self.checkpoints, default=None)
+        shared = self.checkpoints[latest][1] if latest is not None and latest == self.changed_since else None
+        columns = (layer.size[0] + self.tile_size - 1) // self.tile_size
+        rows = (layer.size[1] + self.tile_size - 1) // self.tile_size
+        tiles = {}
+        for ty in range(rows):
+            for tx in range(columns):
+                if shared is not None and (tx, ty) not in self.changed_tiles:
+                    if (tx, ty) in shared:
+                        tiles[(tx, ty)] = shared[(tx, ty)]
+                    continue
+                raw = layer.crop(self.tile_box(layer.size, tx, ty)).tobytes()
+                if np.frombuffer(raw, dtype=np.uint8)[3::4].any():
+                    tiles[(tx, ty)] = self.compressor.submit(zlib.compress, raw, 1)
+                    self.keep_decoded(tiles[(tx, ty)], raw)
+        return (layer.size, tiles)
+
+    def keep_decoded(self, tile, raw):
+        # La référence à la tuile gardée avec ses octets empêche la réutilisation de son id
+        self.decoded[id(tile)] = (tile, raw)
+        self.decoded.move_to_end(id(tile))
+        while len(self.decoded) > self.decoded_tiles:
+            self.decoded.popitem(last=False)
+
+    def decode_tile(self, tile):
+        """Octets RGBA d'une tuile d'image, décompressés au besoin"""
+        cached = self.decoded.get(id(tile))
+        if cached is not None and cached[0] is tile:
+            self.decoded.move_to_end(id(tile))
+            return cached[1]
+        raw = zlib.decompress(tile.result())
+        self.keep_decoded(tile, raw)
+        return raw
+
+    def paste_checkpoint(self, layer, checkpoint, box):
+        """Remettre la zone box de la couche dans l'état d'une image (seules ses tuiles sont décompressées)"""
+        size, tiles = checkpoint
+        layer.paste((0, 0, 0, 0), box)
+        for (tx, ty), compressed in tiles.items():
+            x0, y0, x1, y1 = self.tile_box(size, tx, ty)
+            if not self.boxes_overlap((x0, y0, x1, y1), box):
+                continue
+            tile = Image.frombytes('RGBA', (x1 - x0, y1 - y0), self.decode_tile(compressed))
+            crop = (max(x0, box[0]), max(y0, box[1]), min(x1, box[2]), min(y1, box[3]))
+            layer.paste(tile.crop((crop[0] - x0, crop[1] - y0, crop[2] - x0, crop[3] - y0)), crop[:2])
+
+    @staticmethod
+    def boxes_overlap(a, b):
+        return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+    def undo(self, layer):
+        """Annuler la dernière commande (thread de rendu), retourne la zone à recomposer"""
+        while self.position > self.base and not self.commands[self.position - self.base - 1]['box']:
+            del self.commands[self.position - self.base - 1]
+            self.position -= 1
+        if self.position <= self.undo_floor():
+            return None
+
+        dirty_box = self.commands[self.position - self.base - 1]['box']
+        self.position -= 1
+
+        # Repartir de la plus proche image, puis rejouer dans la zone annulée les commandes qui la touchent
+        start = max(i for i in self.checkpoints if i <= self.position)
+        commands = [command for command in self.commands[start - self.base:self.position - self.base]
+                    if command['box'] and self.boxes_overlap(command['box'], dirty_box)]
+        if not commands:
+            self.paste_checkpoint(layer, self.checkpoints[start], dirty_box)
+            return dirty_box
+        scratch = Image.new('RGBA', layer.size, (0, 0, 0, 0))
+        self.paste_checkpoint(scratch, self.checkpoints[start], dirty_box)
+        for command in commands:
+            self.replay(scratch, command, dirty_box)
+        layer.paste(scratch.crop(dirty_box), dirty_box)
+        return dirty_box
+
+    def undo_floor(self):
+        """Position la plus ancienne qu'on peut atteindre en annulant (plus ancienne image, max_entries commandes)"""
+        oldest = min(self.checkpoints, default=self.position)
+        return max(oldest, self.base + len(self.commands) - self.max_entries)
+
+    def redo(self, layer):
+        """Rétablir la dernière commande annulée (thread de rendu), retourne la zone à recomposer"""
+        if self.position - self.base >= len(self.commands):
+            return None
+        command = self.commands[self.position - self.base]
+        self.position += 1
+        self.replay(layer, command)
+        return command['box']
+
+    def memory_usage(self):
+        """Mémoire occupée par l'historique (images + commandes, estimée), en octets"""
+        # Une tuile partagée entre plusieurs images ne compte qu'une fois ; pas encore compressée, elle compte entière
+        unique = {id(tile): tile for _, tiles in self.checkpoints.values() for tile in tiles.values()}
+        checkpoint_bytes = sum(len(tile.result()) if tile.done() else self.tile_size ** 2 * 4
+                               for tile in unique.values())
+        point_count = sum(len(frame) for command in self.commands for frame in command.get('frames', ()))
+        return checkpoint_bytes + 24 * point_count
+
+    def enforce_budget(self):
+        """Oublier la plus ancienne image et ses commandes tant que la limite est dépassée"""
+        while len(self.checkpoints) > 1:
+            oldest, following = sorted(self.checkpoints)[:2]
+            if following > self.position:
+                return
+            # Les commandes avant following ne peuvent plus être annulées : l'image suivante suffit
+            if following > self.undo_floor() and self.memory_usage() <= self.max_bytes:
+                return
+            del self.checkpoints[oldest]
+            del self.commands[:following - self.base]
+            self.base = following
+
+
+class AssetCache:
+    """Cache disque d'images prétraitées (tableaux RGBA .npy), par empreinte du fichier source et paramètres
+
+    Relire une entrée ne coûte qu'une lecture de fichier, sans décodage ni redimensionnement. Les entrées les
+    plus anciennement utilisées sont supprimées quand le cache dépasse max_bytes : la taille totale est tenue
+    à jour à chaque écriture, le dossier n'est parcouru qu'une fois au départ et lors d'une éviction.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.digests = {}  # (chemin, date de modification, taille) -> empreinte, pour ne hacher qu'une fois
+        self.lock = threading.Lock()
+        self.total_bytes = None  # Taille des entrées, calculée au premier besoin
+        self.reserved_bytes = 0  # Place réservée par les préparations en cours
+
+    def file_digest(self, path):
+        """Empreinte BLAKE2 du contenu du fichier"""
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self.digests.get(memo_key)
+        if digest is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    hasher.update(chunk)
+            digest = self.digests[memo_key] = hasher.hexdigest()
+        return digest
+
+    def entry_path(self, kind, path, params):
+        name = '_'.join([self.file_digest(path)] + [str(param) for param in params])
+        return os.path.join(self.directory, kind, name + '.npy')
+
+    def get(self, entry):
+        """Image RGBA d'une entrée, None si elle n'existe pas ou est illisible"""
+        try:
+            pixels = np.load(entry)
+            os.utime(entry)  # Date d'utilisation, pour l'éviction
+        except (OSError, ValueError):
+            return None
+        return Image.fromarray(pixels, 'RGBA')
+
+    def put(self, entry, image):
+        """Écrire une entrée (fichier temporaire puis remplacement), puis faire de la place si besoin"""
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Fichier temporaire propre au thread : deux threads peuvent préparer la même entrée
+        temporary = f'{entry}.{threading.get_ident()}.part'
+        with open(temporary, 'wb') as f:
+            np.save(f, np.asarray(image.convert('RGBA')))
+        size = os.path.getsize(temporary)
+        with self.lock:
+            total = self.usage()
+            previous = os.path.getsize(entry) if os.path.exists(entry) else 0
+            os.replace(temporary, entry)
+            self.total_bytes = total + size - previous
+            if self.total_bytes > self.max_bytes:
+                self.prune()
+
+    def entries(self):
+        """[(date d'utilisation, taille, chemin)] de toutes les entrées"""
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.npy'):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def reserve(self, size):
+        """Réserver la place d'une entrée à écrire sans rien évincer : False si le cache n'a plus assez de place"""
+        with self.lock:
+            if self.usage() + self.reserved_bytes + size > self.max_bytes:
+                return False
+            self.reserved_bytes += size
+            return True
+
+    def release(self, size):
+        """Rendre une réservation, une fois l'entrée écrite (elle compte alors dans la taille totale) ou abandonnée"""
+        with self.lock:
+            self.reserved_bytes -= size
+
+    def usage(self):
+        """Taille totale des entrées en octets (sous lock)"""
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.entries())
+        return self.total_bytes
+
+    def get_or_create(self, kind, path, params, build):
+        """Image en cache pour (fichier, paramètres), ou build() mise en cache"""
+        entry = self.entry_path(kind, path, params)
+        image = self.get(entry)
+        if image is None:
+            image = build()
+            try:
+                self.put(entry, image)
+            except OSError as e:
+                print(f"Avertissement: impossible d'écrire dans le cache: {e}")
+        return image
+
+    def prune(self):
+        """Supprimer les entrées les plus anciennement utilisées au-delà de max_bytes (sous lock)"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(entry)
+            total -= size
+        self.total_bytes = total
+
+
+class AssetIndex:
+    """Index des fichiers de fonds/, modeles/ et sons/, avec des miniatures en cache disque
+
+    Les miniatures (PNG) sont générées par un groupe de threads ; une miniature est refaite quand
+    la date de modification ou la taille de son fichier change. on_thumbnail(kind, path) est appelé
+    (depuis un thread du groupe) quand une miniature devient disponible.
+    """
+
+    FOLDERS = {
+        'fonds': ('.png', '.jpg', '.jpeg', '.bmp'),
+        'modeles': ('.png', '.jpg', '.jpeg', '.bmp'),
+        'sons': ('.wav', '.mp3', '.ogg'),
+    }
+    IMAGE_FOLDERS = ('fonds', 'modeles')
+
+    def __init__(self, base_dir, cache_dir, thumbnail_size=(240, 135), workers=2, on_thumbnail=None):
+        self.base_dir = base_dir
+        self.thumbnail_dir = os.path.join(cache_dir, 'miniatures')
+        self.index_path = os.path.join(self.thumbnail_dir, 'index.json')
+        self.thumbnail_size = thumbnail_size
+        self.on_thumbnail = on_thumbnail
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='miniatures')
+        self.lock = threading.Lock()
+        self.entries = {kind: [] for kind in self.FOLDERS}
+        self.pending = set()  # Miniatures en cours de génération (chemins relatifs)
+        self.preparing = set()  # Préparations en file : (dossier, chemin, paramètres)
+        # Miniatures connues : chemin relatif -> [date de modification (ns), taille, fichier de la miniature]
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.thumbnails = json.load(f)
+        except (OSError, ValueError):
+            self.thumbnails = {}
+
+    def scan(self):
+        """Relister les dossiers et lancer la génération des miniatures manquantes ou périmées"""
+        for kind, extensions in self.FOLDERS.items():
+            directory = os.path.join(self.base_dir, kind)
+            names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+            entries = []
+            for name in names:
+                if not name.lower().endswith(extensions):
+                    continue
+                path = os.path.join(directory, name)
+                entry = {'kind': kind, 'name': os.path.splitext(name)[0], 'path': path, 'thumbnail': None}
+                if kind in self.IMAGE_FOLDERS:
+                    stat = os.stat(path)
+                    known = self.thumbnails.get(self.relative(path))
+                    if known and known[:2] == [stat.st_mtime_ns, stat.st_size] and \
+                            os.path.exists(os.path.join(self.thumbnail_dir, known[2])):
+                        entry['thumbnail'] = os.path.join(self.thumbnail_dir, known[2])
+                    elif self.relative(path) not in self.pending:
+                        self.pending.add(self.relative(path))
+                        self.pool.submit(self.generate, entry, stat)
+                entries.append(entry)
+            self.entries[kind] = entries
+        return self.entries
+
+    def relative(self, path):
+        return os.path.relpath(path, self.base_dir).replace(os.sep, '/')
+
+    def thumbnail_path(self, path):
+        """Fichier de la miniature d'un fichier indexé, None si elle n'existe pas encore"""
+        known = self.thumbnails.get(self.relative(path))
+        return os.path.join(self.thumbnail_dir, known[2]) if known else None
+
+    def generate(self, entry, stat):
+        """Créer la miniature d'une image (thread du groupe) et l'ajouter à l'index"""
+        relative = self.relative(entry['path'])
+        name = hashlib.blake2b(relative.encode('utf-8'), digest_size=8).hexdigest() + '.png'
+        try:
+            with Image.open(entry['path']) as image:
+                if image.format == 'JPEG':
+                    image.draft('RGB', (self.thumbnail_size[0] * 2, self.thumbnail_size[1] * 2))
+                image = image.convert('RGBA')
+                image.thumbnail(self.thumbnail_size, Image.Resampling.LANCZOS)
+            os.makedirs(self.thumbnail_dir, exist_ok=True)
+            image.save(os.path.join(self.thumbnail_dir, name), compress_level=1)
+        except Exception as e:
+            print(f"Erreur lors de la création de la miniature de {relative}: {e}")
+            self.pending.discard(relative)
+            return
+        with self.lock:
+            self.thumbnails[relative] = [stat.st_mtime_ns, stat.st_size, name]
+            self.save_index()
+        self.pending.discard(relative)
+        entry['thumbnail'] = os.path.join(self.thumbnail_dir, name)
+        if self.on_thumbnail:
+            self.on_thumbnail(entry['kind'], entry['path'])
+
+    def save_index(self):
+        """Écrire l'index des miniatures (sous lock), via un fichier temporaire"""
+        temporary = self.index_path + '.part'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self.thumbnails, f)
+        os.replace(temporary, self.index_path)
+
+    def preprocess(self, kind, cache, params, size, prepare):
+        """Préparer en arrière-plan les fichiers d'un dossier absents du cache (ex. fond à la taille de l'écran)
+
+        Un fichier déjà en file n'est pas renvoyé. Chaque entrée à écrire (image RGBA de taille size) réserve
+        sa place dans le cache, tous dossiers et appels confondus : la préparation s'arrête quand le cache est
+        plein, plutôt que d'évincer des entrées déjà prêtes.
+        """
+        for entry in self.entries[kind]:
+            key = (kind, entry['path'], params)
+            if key in self.preparing:
+                continue
+            self.preparing.add(key)
+            # Taille du fichier .npy : pixels RGBA et en-tête de 128 octets
+            self.pool.submit(self.prepare_entry, key, cache, prepare, size[0] * size[1] * 4 + 128)
+
+    def prepare_entry(self, key, cache, prepare, entry_bytes):
+        """Préparer un fichier (thread du groupe) si son entrée manque et que le cache a la place de l'écrire"""
+        kind, path, params = key
+        try:
+            if os.path.exists(cache.entry_path(kind, path, params)) or not cache.reserve(entry_bytes):
+                return
+            try:
+                prepare(path)
+            finally:
+                cache.release(entry_bytes)
+        except Exception as e:
+            print(f"Erreur lors de la préparation de {os.path.basename(path)}: {e}")
+        finally:
+            self.preparing.discard(key)
+
+    def shutdown(self):
+        """Abandonner les travaux en attente (fermeture de l'application)"""
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class SessionStore:
+    """Sauvegarde automatique incrémentale de la couche de dessin, dans un fichier en ajout seul
+
+    Chaque sauvegarde ajoute les seules tuiles modifiées (RGBA compressé zlib, CRC32), suivies d'une
+    marque de validation. À la lecture, un lot sans sa marque (plantage pendant l'écriture) est ignoré :
+    on retrouve le dessin de la dernière sauvegarde complète. Le fichier est réécrit (compacté) avec
+    la dernière version de chaque tuile quand les anciennes versions y prennent trop de place.
+    """
+
+    MAGIC = b'SPRAYAS1'
+    HEADER = struct.Struct('<8sIII')  # Signature, largeur, hauteur, côté des tuiles
+    RECORD = struct.Struct('<cHHII')  # Type, tuile x, tuile y, longueur (ou nombre de tuiles), CRC32
+    TILE, COMMIT = b'T', b'C'
+
+    def __init__(self, path, size, tile_size=SprayBrush.TILE_SIZE, compact_ratio=3,
+                 compact_min_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.size = tuple(size)
+        self.tile_size = tile_size
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.payloads = {}  # Dernière version compressée de chaque tuile non vide
+        self.file_bytes = 0
+        self.lock = threading.Lock()  # Une seule écriture à la fois
+
+    def live_bytes(self):
+        return sum(len(data) for data in self.payloads.values())
+
+    def start(self, payloads=None):
+        """Commencer un nouveau fichier, avec les tuiles données (session restaurée) ou vide"""
+        with self.lock:
+            self.payloads = dict(payloads or {})
+            self.compact()
+
+    def write_tiles(self, tiles):
+        """Ajouter les tuiles modifiées [(tx, ty, octets RGBA ou None si vide)] puis valider le lot"""
+        if not tiles:
+            return 0
+        records = []
+        for tx, ty, raw in tiles:
+            data = zlib.compress(raw, 1) if raw else b''
+            records.append(self.RECORD.pack(self.TILE, tx, ty, len(data), zlib.crc32(data)) + data)
+            if data:
+                self.payloads[(tx, ty)] = data
+            else:
+                self.payloads.pop((tx, ty), None)
+        records.append(self.RECORD.pack(self.COMMIT, 0, 0, len(tiles), 0))
+
+        with self.lock:
+            with open(self.path, 'ab') as f:
+                for record in records:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+                self.file_bytes = f.tell()
+            if self.file_bytes > max(self.compact_min_bytes, self.compact_ratio * self.live_bytes()):
+                self.compact()
+        return len(tiles)
+
+    def compact(self):
+        """Réécrire le fichier avec la dernière version de chaque tuile (fichier temporaire puis remplacement)"""
+        temporary = self.path + '.part'
+        with open(temporary, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.size[0], self.size[1], self.tile_size))
+            for (tx, ty), data in self.payloads.items():
+                f.write(self.RECORD.pack(self.TILE, tx, ty, len(data), zlib.crc32(data)) + data)
+            f.write(self.RECORD.pack(self.COMMIT, 0, 0, len(self.payloads), 0))
+            f.flush()
+            os.fsync(f.fileno())
+            self.file_bytes = f.tell()
+        os.replace(temporary, self.path)
+
+    @classmethod
+    def read(cls, path):
+        """Lire un fichier de session, retourne (taille, côté des tuiles, {(tx, ty): octets zlib})
+
+        La lecture s'arrête au premier enregistrement tronqué ou corrompu ; seuls les lots validés comptent.
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < cls.HEADER.size:
+            raise ValueError("fichier de session incomplet")
+        magic, width, height, tile_size = cls.HEADER.unpack_from(content)
+        if magic != cls.MAGIC:
+            raise ValueError("ce n'est pas un fichier de session")
+
+        payloads, pending = {}, {}
+        offset = cls.HEADER.size
+        while offset + cls.RECORD.size <= len(content):
+            kind, tx, ty, length, crc = cls.RECORD.unpack_from(content, offset)
+            offset += cls.RECORD.size
+            if kind == cls.COMMIT:
+                payloads.update(pending)
+                pending = {}
+                continue
+            data = content[offset:offset + length]
+            if kind != cls.TILE or len(data) != length or zlib.crc32(data) != crc:
+                break
+            offset += length
+            pending[(tx, ty)] = data
+        return (width, height), tile_size, {tile: data for tile, data in payloads.items() if data}
+
+    @staticmethod
+    def decode_tiles(payloads, size, tile_size):
+        """Tuiles compressées -> [(tx, ty, octets RGBA)] aux dimensions de chaque tuile"""
+        tiles = []
+        for (tx, ty), data in payloads.items():
+            width = min(tile_size, size[0] - tx * tile_size)
+            height = min(tile_size, size[1] - ty * tile_size)
+            tiles.append((tx, ty, (width, height), zlib.decompress(data)))
+        return tiles
+
+
+class SprayEngine:
+    """Moteur de peinture sans interface : couches, pinceau, composition et historique
+
+    L'application Qt n'en est qu'un adaptateur ; le moteur peut aussi tourner seul (tests, mesures).
+    Toutes les méthodes qui modifient les couches doivent être appelées sous layer_lock.
+    """
+
+    # Résolution de référence : tailles et placements de l'application sont définis pour celle-ci
+    REFERENCE_SIZE = (1920, 1080)
+
+    def __init__(self, size=REFERENCE_SIZE, seed=None, max_history=50, history_budget=256 * 1024 * 1024):
+        self.size = size
+        self.scale = min(size[0] / self.REFERENCE_SIZE[0], size[1] / self.REFERENCE_SIZE[1])
+
+        # Couche de dessin séparée (pour isoler le dessin du fond/modèle)
+        self.drawing_layer = Image.new('RGBA', size, (0, 0, 0, 0))
+
+        # Images, le modèle étant placé par son centre et son côté à l'échelle de l'écran
+        self.background_image = None
+        self.template_image = None
+        self.template_position = (round(725 * size[0] / self.REFERENCE_SIZE[0]),
+                                  round(540 * size[1] / self.REFERENCE_SIZE[1]))
+        self.template_size = self.scaled(1000)
+
+        # Couches statiques pré-composées, par option (avec fond, avec modèle)
+        self.base_layers = {}
+
+        # Verrou des couches, partagé avec le thread qui dessine
+        self.layer_lock = threading.RLock()
+
+        # Générateur de particules du spray
+        self.brush = SprayBrush(scale=self.scale)
+
+        # Espacement des jets le long d'un trait, relatif à la taille du spray
+        self.dab_spacing = 0.1
+
+        # Gomme
+        self.eraser_softness = 0.0  # Fraction du rayon adoucie au bord (0 = bord net)
+        self.eraser_masks = {}
+
+        # Historique : journal des traits rejouables, avec une image de la couche tous les 10 traits
+        self.history = StrokeHistory(self.replay_command, max_history, history_budget)
+        self.stroke_seeds = np.random.default_rng(seed)  # Source des graines de chaque trait
+
+        # Trait en cours : commande d'historique, dernière position et distance jusqu'au prochain jet
+        self.current_stroke = None
+        self.last_point = None
+        self.next_dab_distance = 0.0
+
+        # Durées (ms) des étapes du dernier lot de jets, pour les mesures de l'application
+        self.stage_times = {}
+
+        # Tuiles de la couche de dessin modifiées depuis la dernière sauvegarde automatique
+        self.dirty_tiles = set()
+
+    def scaled(self, value):
+        """Mettre une longueur définie en 1920x1080 à l'échelle du moteur"""
+        return max(1, round(value * self.scale))
+
+    def set_random_seed(self, seed):
+        """Fixer la graine des traits suivants : une même session redonne alors exactement le même dessin"""
+        self.stroke_seeds = np.random.default_rng(seed)
+
+    def warm(self, sizes, opacities):
+        """Pré-calculer les masques de gomme et, en arrière-plan, les banques de jets (dans l'ordre donné)"""
+        for size in sizes:
+            self.get_eraser_mask(size)
+        self.brush.stamps.warm([(size, opacity) for size in sizes for opacity in opacities])
+
+    def begin_stroke(self, x, y, color, size, opacity, eraser=False):
+        """Commencer un trait en (x, y) et l'enregistrer dans l'historique
+
+        color est une couleur hexadécimale (#RRGGBB) ou un triplet RGB.
+        """
+        if isinstance(color, str):
+            color = tuple(int(color.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4))
+
+        # Tous les paramètres du trait et la graine des particules, pour pouvoir le rejouer à l'identique
+        self.current_stroke = {
+            'kind': 'stroke',
+            'start': (x, y),
+            'frames': [],
+            'eraser': eraser,
+            'color': color,
+            'size': size,
+            'opacity': opacity,
+            'spacing': max(size * self.dab_spacing, 1.0),
+            'seed': int(self.stroke_seeds.integers(2 ** 63)),
+            'box': None,
+        }
+        self.last_point = (x, y)
+        self.next_dab_distance = 0.0
+        self.history.begin(self.drawing_layer, self.current_stroke)
+        self.brush.reseed(self.current_stroke['seed'])
+        return self.current_stroke
+
+    def add_points(self, points):
+        """Prolonger le trait en cours d'un lot de positions [(x, y, timestamp)]
+
+        Les jets du lot sont appliqués en une fois ; retourne la liste des zones modifiées.
+        """
+        stroke = self.current_stroke
+        if stroke is None or not points:
+            return []
+
+        # Jets répartis le long des segments depuis la dernière position
+        start = time.perf_counter()
+        positions = []
+        for x, y, _ in points:
+            dabs, self.next_dab_distance = self.dab_positions(
+                self.last_point, (x, y), stroke['spacing'], self.next_dab_distance)
+            positions.extend(dabs)
+            self.last_point = (x, y)
+        # Les lots sont gardés tels quels : les rejouer dans le même ordre donne les mêmes pixels
+        stroke['frames'].append(list(points))
+        self.stage_times = {'interpolation': (time.perf_counter() - start) * 1000, 'jets': len(positions)}
+        if not positions:
+            return []
+
+        boxes = self.draw_dabs(self.drawing_layer, positions, stroke['eraser'], stroke['color'],
+                               stroke['size'], stroke['opacity'])
+        for box in boxes:
+            self.mark_dirty(box)
+        # Zone touchée par le trait, utilisée pour l'annuler
+        if boxes:
+            boxes_union = boxes + [stroke['box']] if stroke['box'] else boxes
+            stroke['box'] = (min(b[0] for b in boxes_union), min(b[1] for b in boxes_union),
+                             max(b[2] for b in boxes_union), max(b[3] for b in boxes_union))
+        return boxes
+
+    def add_point(self, x, y, timestamp=0):
+        """Prolonger le trait en cours d'une seule position"""
+        return self.add_points([(x, y, timestamp)])
+
+    def end_stroke(self):
+        """Terminer le trait en cours, retourne la zone qu'il a touchée"""
+        stroke, self.current_stroke = self.current_stroke, None
+        if stroke:
+            self.history.end(self.drawing_layer)
+        return stroke['box'] if stroke else None
+
+    def clear(self):
+        """Effacer la couche de dessin (annulable comme un trait), retourne la zone effacée"""
+        command = {'kind': 'clear', 'box': self.drawing_layer.getbbox()}
+        self.history.begin(self.drawing_layer, command)
+        if command['box']:
+            self.replay_command(self.drawing_layer, command)
+            self.mark_dirty(command['box'])
+            self.history.end(self.drawing_layer)
+        return command['box']
+
+    def undo(self):
+        """Annuler le dernier trait, retourne la zone à recomposer"""
+        return self.mark_dirty(self.history.undo(self.drawing_layer))
+
+    def redo(self):
+        """Rétablir le dernier trait annulé, retourne la zone à recomposer"""
+        return self.mark_dirty(self.history.redo(self.drawing_layer))
+
+    def mark_dirty(self, box):
+        """Noter les tuiles touchées par une zone modifiée de la couche de dessin, retourne la zone"""
+        clipped = self.clip_box(box) if box else None
+        if clipped:
+            tile = self.brush.TILE_SIZE
+            x0, y0, x1, y1 = clipped
+            tiles = {(tx, ty) for ty in range(y0 // tile, (y1 - 1) // tile + 1)
+                     for tx in range(x0 // tile, (x1 - 1) // tile + 1)}
+            self.dirty_tiles.update(tiles)
+            self.history.mark_changed(tiles)
+        return box
+
+    def capture_dirty_tiles(self):
+        """Copier les tuiles modifiées depuis l'appel précédent (sous layer_lock)
+
+        Retourne [(tx, ty, octets RGBA ou None si la tuile est vide)].
+        """
+        tile = self.brush.TILE_SIZE
+        tiles = []
+        for tx, ty in sorted(self.dirty_tiles):
+            region = self.drawing_layer.crop(self.clip_box((tx * tile, ty * tile, (tx + 1) * tile, (ty + 1) * tile)))
+            tiles.append((tx, ty, region.tobytes() if region.getbbox() else None))
+        self.dirty_tiles = set()
+        return tiles
+
+    def restore_tiles(self, tiles):
+        """Recréer la couche de dessin à partir de tuiles [(tx, ty, taille, octets RGBA)] (session restaurée)"""
+        tile = self.brush.TILE_SIZE
+        self.drawing_layer = Image.new('RGBA', self.size, (0, 0, 0, 0))
+        for tx, ty, size, raw in tiles:
+            self.drawing_layer.paste(Image.frombytes('RGBA', size, raw), (tx * tile, ty * tile))
+        self.dirty_tiles = set()
+        # Le dessin restauré est le point de départ de l'historique
+        self.history = StrokeHistory(self.replay_command, self.history.max_entries, self.history.max_bytes,
+                                     self.history.checkpoint_interval)
+        return self.drawing_layer.getbbox()
+
+    def replay_command(self, layer, command, clip=None):
+        """Rejouer une commande de l'historique sur une couche (seulement les jets qui touchent clip, si donnée)"""
+        if command['kind'] == 'clear':
+            layer.paste((0, 0, 0, 0), command['box'])
+            return
+
+        self.brush.reseed(command['seed'])
+        last = command['start']
+        distance = 0.0
+        for frame in command['frames']:
+            positions = []
+            for x, y, _ in frame:
+                dabs, distance = self.dab_positions(last, (x, y), command['spacing'], distance)
+                positions.extend(dabs)
+                last = (x, y)
+            if positions:
+                self.draw_dabs(layer, positions, command['eraser'], command['color'],
+                               command['size'], command['opacity'], clip)
+
+    @staticmethod
+    def dab_positions(start, end, spacing, distance):
+        """Positions des jets sur le segment start -> end, espacés de spacing
+
+        distance est la distance restante jusqu'au prochain jet ; la nouvelle est retournée avec
+        les positions, pour que la densité du trait ne dépende pas de la fréquence des événements.
+        """
+        x0, y0 = start
+        dx, dy = end[0] - x0, end[1] - y0
+        length = (dx ** 2 + dy ** 2) ** 0.5
+
+        positions = []
+        while distance <= length:
+            t = distance / length if length else 0.0
+            positions.append((int(round(x0 + dx * t)), int(round(y0 + dy * t))))
+            distance += spacing
+        return positions, distance - length
+
+    def draw_dabs(self, layer, positions, eraser, rgb_color, spray_size, spray_opacity, clip=None):
+        """Appliquer un lot de jets sur une couche, retourne la liste des zones modifiées
+
+        Avec clip, seuls les jets qui touchent cette zone sont appliqués (les pixels de la zone sont identiques).
+        """
+        start = time.perf_counter()
+        if eraser:
+            if clip:
+                positions = [(x, y) for x, y in positions if self.dab_touches(x, y, spray_size + 1, clip)]
+                if not positions:
+                    return []
+            dirty_box = self.erase_dabs(layer, positions, spray_size)
+            self.stage_times['calque'] = (time.perf_counter() - start) * 1000
+            return [dirty_box] if dirty_box else []
+
+        # Spray réaliste : chaque jet est un tirage dans la banque de jets pré-calculés, appliqués en un seul lot
+        stamps = self.brush.pick_stamps(len(positions), spray_size, spray_opacity)
+        dabs = [(x, y, stamp) for (x, y), stamp in zip(positions, stamps)]
+        if clip:
+            # Les jets sont tirés pour toutes les positions : le générateur avance comme pour le trait entier
+            reach = int(spray_size * 2) + self.brush.footprint_reach + 1
+            dabs = [dab for dab in dabs if self.dab_touches(dab[0], dab[1], reach, clip)]
+        picked = time.perf_counter()
+        boxes = self.brush.splat(layer, dabs, rgb_color)
+        self.stage_times['particules'] = (picked - start) * 1000
+        self.stage_times['calque'] = (time.perf_counter() - picked) * 1000
+        return boxes
+
+    @staticmethod
+    def dab_touches(x, y, reach, box):
+        """Un jet centré en (x, y), de rayon reach, touche-t-il la zone box ?"""
+        return x - reach < box[2] and box[0] <= x + reach and y - reach < box[3] and box[1] <= y + reach
+
+    def set_background(self, image):
+        """Changer l'image de fond (redimensionnée à la taille du moteur), None pour l'enlever"""
+        if image is not None:
+            image = self.fit_image(image, self.size)
+        with self.layer_lock:
+            self.background_image = image
+            self.invalidate_base_layers()
+
+    def set_template(self, image):
+        """Changer l'image modèle (redimensionnée au côté du modèle), None pour l'enlever"""
+        if image is not None:
+            image = self.fit_image(image, (self.template_size, self.template_size))
+        with self.layer_lock:
+            self.template_image = image
+            self.invalidate_base_layers()
+
+    @staticmethod
+    def fit_image(image, size):
+        """Image RGBA à la taille donnée (redimensionnée hors du verrou, seulement si besoin)"""
+        # Une image RGB est redimensionnée avant d'ajouter l'alpha : 3 canaux au lieu de 4, même résultat
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        return image if image.mode == 'RGBA' else image.convert('RGBA')
+
+    def decode_background(self, path, cache=None):
+        """Décoder un fichier image en fond à la taille du moteur (hors du thread de l'interface)
+
+        Un JPEG est décodé directement à taille réduite (mode brouillon, 1/2 à 1/8), sans passer sous
+        la taille du moteur. Avec un AssetCache, le fond prêt est gardé par empreinte et résolution.
+        """
+        def build():
+            with Image.open(path) as image:
+                if image.format == 'JPEG':
+                    image.draft('RGB', self.size)
+                return self.fit_image(image, self.size)
+
+        if cache is None:
+            return build()
+        return cache.get_or_create('fonds', path, self.background_params(), build)
+
+    def background_params(self):
+        """Paramètres de l'entrée de cache d'un fond"""
+        return ('%dx%d' % self.size,)
+
+    def extract_template(self, image, flood_fill=False, threshold=50, opacity=0.6):
+        """Préparer une image modèle : côté du modèle, fond détecté dans les coins rendu transparent, 60% d'opacité
+
+        Avec flood_fill, seul le fond relié aux coins est retiré : les zones de la couleur du fond
+        enfermées dans le dessin (intérieur d'une lettre, yeux...) restent visibles.
+        """
+        img = self.fit_image(image, (self.template_size, self.template_size))
+
+        # Extraire automatiquement le contenu en supprimant le fond, directement sur les octets de l'image
+        img_array = np.array(img)
+        rgb, alpha = img_array[:, :, :3], img_array[:, :, 3]
+
+        # Détecter le fond (couleur dominante dans les coins)
+        corners = [
+            (slice(0, 10), slice(0, 10)),  # Haut gauche
+            (slice(0, 10), slice(-10, None)),  # Haut droit
+            (slice(-10, None), slice(0, 10)),  # Bas gauche
+            (slice(-10, None), slice(-10, None))  # Bas droit
+        ]
+        corner_pixels = np.concatenate([rgb[rows, columns].reshape(-1, 3) for rows, columns in corners])
+        bg_color = np.median(corner_pixels, axis=0).astype(np.int16)
+
+        # Pixels similaires au fond (écart < threshold sur chaque canal), comparés en uint8 :
+        # |v - fond| < seuil  <=>  fond - seuil < v < fond + seuil, bornes ramenées à 0..255
+        is_background = np.ones(alpha.shape, dtype=bool)
+        for channel in range(3):
+            low = np.uint8(max(bg_color[channel] - threshold + 1, 0))
+            high = np.uint8(min(bg_color[channel] + threshold - 1, 255))
+            values = rgb[:, :, channel]
+            is_background &= values >= low
+            is_background &= values <= high
+
+        if flood_fill:
+            seeds = np.zeros_like(is_background)
+            for rows, columns in corners:
+                seeds[rows, columns] = True
+            is_background = self.connected_region(is_background, seeds)
+
+        # 60% d'opacité au contenu restant (table sur les 256 valeurs, comme ImageEnhance.Brightness),
+        # fond transparent
+        alpha[:] = (np.arange(256) * opacity).astype(np.uint8)[alpha]
+        alpha[is_background] = 0
+        return Image.fromarray(img_array, 'RGBA')
+
+    @staticmethod
+    def connected_region(mask, seeds):
+        """Pixels de mask reliés (4-connexité) à un pixel de seeds
+
+        Remplissage par segments : chaque passe étend l'atteint à des segments entiers de mask, en lignes
+        puis en colonnes, jusqu'à ce que plus rien ne change (une passe par changement de direction du chemin).
+        """
+        def segments(mask):
+            # Numéro de segment de chaque pixel le long des lignes : un segment commence là où mask passe à True
+            starts = mask.copy()
+            starts[:, 1:] &= ~mask[:, :-1]
+            return np.cumsum(starts.ravel()).reshape(mask.shape)
+
+        # Segments en lignes et en colonnes, calculés une fois (mask ne change pas)
+        row_segments = segments(mask)
+        column_segments = np.ascontiguousarray(segments(np.ascontiguousarray(mask.T)).T)
+
+        reached = seeds & mask
+        while True:
+            grown = reached
+            for segment in (row_segments, column_segments):
+                hit = np.zeros(segment[-1, -1] + 1, dtype=bool)  # Le dernier pixel porte le plus grand numéro
+                hit[segment[grown]] = True
+                grown = mask & hit[segment]
+            if np.array_equal(grown, reached):
+                return reached
+            reached = grown
+
+    def decode_template(self, path, cache=None, flood_fill=False, threshold=50, opacity=0.6):
+        """Lire un fichier image et en extraire le modèle (hors du thread de l'interface)
+
+        Avec un AssetCache, le modèle prêt est gardé par empreinte du fichier, côté et paramètres.
+        """
+        def build():
+            with Image.open(path) as image:
+                return self.extract_template(image, flood_fill, threshold, opacity)
+
+        if cache is None:
+            return build()
+        return cache.get_or_create('modeles', path, self.template_params(flood_fill, threshold, opacity), build)
+
+    def template_params(self, flood_fill=False, threshold=50, opacity=0.6):
+        """Paramètres de l'entrée de cache d'un modèle"""
+        return (self.template_size, 'remplissage' if flood_fill else 'couleur', threshold, opacity)
+
+    def get_base_layer(self, include_background=True, include_template=True):
+        """Couche statique pré-composée (blanc + fond + modèle), mise en cache par option"""
+        key = (include_background, include_template)
+        size = self.drawing_layer.size
+        base = self.base_layers.get(key)
+        if base is not None and base.size == size:
+            return base
+
+        base = self.build_base_layer(size, *self.base_layer_sources(include_background, include_template))
+        self.base_layers[key] = base
+        return base
+
+    def base_layer_sources(self, include_background=True, include_template=True):
+        """Images et placement nécessaires pour composer une couche statique"""
+        return (include_background, self.background_image if include_background else None,
+                self.template_image if include_template else None, self.template_position, self.template_size)
+
+    @classmethod
+    def build_base_layer(cls, size, opaque, background_image, template_image, template_position, template_size,
+                         band_height=None):
+        """Composer une couche statique : blanc (ou transparent) + fond + modèle placé par son centre"""
+        # Fond blanc pour l'affichage, transparent si on sauvegarde sans le fond
+        if opaque:
+            base = Image.new('RGBA', size, (255, 255, 255, 255))
+            if background_image:
+                cls.composite_bands(base, background_image, band_height)
+        else:
+            base = Image.new('RGBA', size, (0, 0, 0, 0))
+
+        # Le modèle est collé avec alpha compositing pour gérer la transparence
+        if template_image:
+            x = template_position[0] - template_size // 2
+            y = template_position[1] - template_size // 2
+            # Créer une image temporaire pour placer le modèle
+            temp_layer = Image.new('RGBA', size, (0, 0, 0, 0))
+            temp_layer.paste(template_image, (x, y), template_image)
+            cls.composite_bands(base, temp_layer, band_height)
+        return base
+
+    def invalidate_base_layers(self):
+        """Oublier les couches statiques (fond ou modèle modifié)"""
+        self.base_layers = {}
+
+    def compose_image(self, include_background=True, include_template=True):
+        """Image complète (couche statique + dessin), pour la sauvegarde"""
+        return self.compose_snapshot((self.get_base_layer(include_background, include_template),
+                                      self.drawing_layer))
+
+    def snapshot(self, include_background=True, include_template=True):
+        """Couches à composer, figées (sous layer_lock) : la composition peut ensuite se faire dans un autre thread
+
+        Les images du fond, du modèle et les couches statiques en cache ne sont jamais modifiées en place :
+        seul le dessin est copié. Une couche statique absente du cache est composée par compose_snapshot.
+        """
+        base = self.base_layers.get((include_background, include_template))
+        if base is None or base.size != self.drawing_layer.size:
+            base = self.base_layer_sources(include_background, include_template)
+        return base, self.drawing_layer.copy()
+
+    @classmethod
+    def compose_snapshot(cls, snapshot, band_height=None, progress=None):
+        """Image complète à partir d'un instantané (couche statique ou ses sources, dessin)
+
+        Avec band_height, le dessin est fusionné par bandes horizontales : Pillow garde le GIL pendant
+        alpha_composite, les bandes laissent les autres threads (interface, rendu) s'exécuter entre deux.
+        progress(fraction) est appelé après chaque bande.
+        """
+        base, drawing = snapshot
+        if isinstance(base, tuple):
+            base = cls.build_base_layer(drawing.size, *base, band_height=band_height)
+        final_image = base.copy()
+        cls.composite_bands(final_image, drawing, band_height, progress)
+        return final_image
+
+    @staticmethod
+    def composite_bands(target, layer, band_height=None, progress=None):
+        """alpha_composite de layer sur target, en une fois ou par bandes horizontales de band_height lignes"""
+        if band_height is None:
+            target.alpha_composite(layer)
+            return
+        width, height = layer.size
+        for top in range(0, height, band_height):
+            bottom = min(top + band_height, height)
+            target.alpha_composite(layer, dest=(0, top), source=(0, top, width, bottom))
+            if progress:
+                progress(bottom / height)
+
+    @staticmethod
+    def save_options(path, png_compression=6):
+        """Format Pillow et paramètres d'encodage selon l'extension du fichier
+
+        PNG : niveau de compression zlib (1 rapide, 9 compact) ; WebP : sans perte, effort minimal,
+        plus rapide à encoder qu'un PNG de même taille.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.webp':
+            return 'WEBP', {'lossless': True, 'method': 0, 'quality': 0}
+        if extension in ('.jpg', '.jpeg'):
+            return 'JPEG', {}
+        return 'PNG', {'compress_level': png_compression}
+
+    @classmethod
+    def save_image(cls, image, path, png_compression=6):
+        """Encoder et écrire l'image via un fichier temporaire : le fichier final n'est jamais à moitié écrit"""
+        image_format, options = cls.save_options(path, png_compression)
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        temporary = path + '.part'
+        try:
+            image.save(temporary, format=image_format, **options)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def erase_dabs(self, layer, positions, radius):
+        """Effacer un lot de cercles de gomme avec un seul aller-retour sur la couche"""
+        boxes = [(x - radius, y - radius, x + radius + 1, y + radius + 1) for x, y in positions]
+        dirty_box = self.clip_box((min(b[0] for b in boxes), min(b[1] for b in boxes),
+                                   max(b[2] for b in boxes), max(b[3] for b in boxes)))
+        if not dirty_box:
+            return None
+
+        keep_mask = np.asarray(self.get_eraser_mask(radius), dtype=np.uint16)
+        region = layer.crop(dirty_box)
+        alpha = np.array(region.getchannel('A'), dtype=np.uint16)
+        for box in boxes:
+            clipped = self.clip_box(box)
+            if not clipped:
+                continue
+            # Partie du masque visible dans la zone, en coordonnées de la région
+            mx0, my0 = clipped[0] - box[0], clipped[1] - box[1]
+            mx1, my1 = clipped[2] - box[0], clipped[3] - box[1]
+            rx0, ry0 = clipped[0] - dirty_box[0], clipped[1] - dirty_box[1]
+            rx1, ry1 = clipped[2] - dirty_box[0], clipped[3] - dirty_box[1]
+            alpha[ry0:ry1, rx0:rx1] = (alpha[ry0:ry1, rx0:rx1] * keep_mask[my0:my1, mx0:mx1] + 127) // 255
+
+        region.putalpha(Image.fromarray(alpha.astype(np.uint8), 'L'))
+        layer.paste(region, dirty_box)
+        return dirty_box
+
+    def get_eraser_mask(self, radius):
+        """Masque de la gomme (255 = conservé, 0 = effacé), pré-calculé pour chaque palier"""
+        mask = self.eraser_masks.get(radius)
+        if mask is None:
+            mask = self.build_eraser_mask(radius)
+            self.eraser_masks[radius] = mask
+        return mask
+
+    def set_eraser_softness(self, softness):
+        """Changer l'adoucissement du bord de la gomme et recalculer les masques"""
+        self.eraser_softness = softness
+        self.eraser_masks = {size: self.build_eraser_mask(size) for size in self.eraser_masks}
+
+    def build_eraser_mask(self, radius):
+        """Construire le masque circulaire de la gomme, avec un bord adouci optionnel"""
+        diameter = 2 * radius + 1
+        if self.eraser_softness <= 0:
+            mask = Image.new('L', (diameter, diameter), 255)
+            ImageDraw.Draw(mask).ellipse([0, 0, 2 * radius, 2 * radius], fill=0)
+            return mask
+
+        # Bord adouci : l'effacement diminue linéairement sur la fraction du rayon choisie
+        offsets = np.arange(diameter) - radius
+        distance = np.sqrt(offsets[None, :] ** 2 + offsets[:, None] ** 2)
+        strength = np.clip((radius - distance) / (radius * self.eraser_softness), 0, 1)
+        return Image.fromarray(np.rint(255 * (1 - strength)).astype(np.uint8), 'L')
+
+    def clip_box(self, box):
+        """Limiter une boîte (x0, y0, x1, y1) à la taille du canvas, None si elle est vide"""
+        width, height = self.drawing_layer.size
+        x0, y0 = max(box[0], 0), max(box[1], 0)
+        x1, y1 = min(box[2], width), min(box[3], height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (x0, y0, x1, y1)
+
+    def render_region(self, box, target):
+        """Composer couche statique + dessin d'une zone et l'écrire dans un tampon BGRA de l'affichage"""
+        x0, y0, x1, y1 = box
+        region = self.get_base_layer().crop(box)
+        region.alpha_composite(self.drawing_layer, source=box)
+        # Le canvas étant opaque, les pixels BGRA directs sont déjà prémultipliés
+        target[:] = np.frombuffer(region.tobytes("raw", "BGRA"), dtype=np.uint8).reshape(y1 - y0, x1 - x0, 4)
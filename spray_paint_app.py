@@ -1,16 +1,28 @@
 import sys
 import os
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QPushButton, QLabel, QFileDialog,
-                             QMessageBox, QCheckBox, QDialog, QGridLayout)
-from PyQt5.QtCore import Qt, QPoint, QTimer, QPropertyAnimation, QRect
-from PyQt5.QtGui import (QPainter, QColor, QPen, QImage, QPixmap, QPainterPath,
-                         QLinearGradient, QRadialGradient, QBrush, QCursor)
-from PIL import Image, ImageEnhance, ImageDraw
-import random
+                             QMessageBox, QCheckBox, QDialog, QGridLayout, QComboBox,
+                             QToolButton, QScrollArea, QScroller)
+from PyQt5.QtCore import (Qt, QPoint, QPointF, QSize, QTimer, QPropertyAnimation, QRect, QThread,
+                          pyqtSignal, QEvent)
+from PyQt5.QtGui import (QPainter, QColor, QPen, QImage, QPixmap, QPainterPath, QFont,
+                         QLinearGradient, QRadialGradient, QBrush, QCursor, QRegion, QMouseEvent, QIcon)
 import pygame
 import numpy as np
 
+from spray_engine import SprayEngine, SessionStore, AssetCache, AssetIndex
+
 
 class SaveDialog(QDialog):
     """Dialogue personnalisé pour les options de sauvegarde"""
@@ -19,7 +31,7 @@ class SaveDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("Options de sauvegarde")
         self.setModal(True)
-        self.setFixedSize(400, 280)
+        self.setFixedSize(400, 340)
 
         # Style du dialogue
         self.setStyleSheet("""
@@ -49,6 +61,12 @@ class SaveDialog(QDialog):
                 background: #4a9eff;
                 border: 2px solid #4a9eff;
             }
+            QComboBox {
+                color: black;
+                font-size: 12px;
+                padding: 4px;
+                background: #f0f0f0;
+            }
             QPushButton {
                 background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
                     stop:0 #f0f0f0, stop:1 #d0d0d0);
@@ -86,6 +104,16 @@ class SaveDialog(QDialog):
         self.include_template.setChecked(False)
         layout.addWidget(self.include_template)
 
+        # Compression PNG : niveau zlib (l'encodage se fait en arrière-plan, le dessin continue)
+        compression_label = QLabel("Compression PNG")
+        compression_label.setStyleSheet("font-size: 12px; margin-top: 10px;")
+        layout.addWidget(compression_label)
+        self.png_compression = QComboBox()
+        for label, level in (("Rapide (fichier plus gros)", 1), ("Normale", 6), ("Maximale (lente)", 9)):
+            self.png_compression.addItem(label, level)
+        self.png_compression.setCurrentIndex(1)
+        layout.addWidget(self.png_compression)
+
         # Boutons
         btn_layout = QHBoxLayout()
 
@@ -104,6 +132,560 @@ class SaveDialog(QDialog):
         self.setLayout(layout)
 
 
+class AssetPicker(QDialog):
+    """Choix tactile d'un fond, d'un modèle ou d'un son parmi les fichiers de son dossier (miniatures en cache)"""
+
+    def __init__(self, title, entries, thumbnail_size, browse, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.setModal(True)
+        self.selected_path = None
+        self.browse = browse
+        self.buttons = {}
+
+        # Grand dialogue, boutons larges : pensé pour le stylet et le doigt
+        if parent:
+            self.resize(min(int(parent.width() * 0.8), 1400), min(int(parent.height() * 0.8), 900))
+        else:
+            self.resize(1000, 700)
+
+        self.setStyleSheet("""
+            QDialog {
+                background-color: #d0d0d0;
+            }
+            QLabel {
+                color: black;
+                font-size: 16px;
+                font-weight: bold;
+                background-color: transparent;
+            }
+            QScrollArea, QScrollArea > QWidget > QWidget {
+                background: transparent;
+                border: none;
+            }
+            QToolButton {
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #f0f0f0, stop:1 #d0d0d0);
+                color: black;
+                border: 2px solid #808080;
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 13px;
+            }
+            QToolButton:pressed {
+                background: #b0b0b0;
+            }
+            QPushButton {
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #f0f0f0, stop:1 #d0d0d0);
+                color: black;
+                border: 2px solid #808080;
+                border-radius: 5px;
+                padding: 14px 30px;
+                font-size: 14px;
+                font-weight: bold;
+            }
+        """)
+
+        layout = QVBoxLayout()
+        label = QLabel(title)
+        label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(label)
+
+        # Grille des fichiers, défilable au doigt
+        grid_widget = QWidget()
+        grid = QGridLayout()
+        grid.setSpacing(16)
+        columns = max(1, (self.width() - 80) // (thumbnail_size[0] + 40))
+        for i, entry in enumerate(entries):
+            button = QToolButton()
+            button.setText(entry['name'])
+            button.setFixedSize(thumbnail_size[0] + 24, thumbnail_size[1] + 56)
+            if entry['kind'] == 'sons':
+                button.setText(f"🔊\n{entry['name']}")
+                button.setToolButtonStyle(Qt.ToolButtonTextOnly)
+            else:
+                button.setIconSize(QSize(*thumbnail_size))
+                button.setToolButtonStyle(Qt.ToolButtonTextUnderIcon)
+                if entry['thumbnail']:
+                    button.setIcon(QIcon(entry['thumbnail']))
+            button.clicked.connect(lambda _, path=entry['path']: self.choose(path))
+            self.buttons[entry['path']] = button
+            grid.addWidget(button, i // columns, i % columns)
+        if not entries:
+            grid.addWidget(QLabel("Aucun fichier dans le dossier"), 0, 0)
+        grid_widget.setLayout(grid)
+
+        scroll = QScrollArea()
+        scroll.setWidget(grid_widget)
+        scroll.setWidgetResizable(True)
+        scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        QScroller.grabGesture(scroll.viewport(), QScroller.LeftMouseButtonGesture)
+        layout.addWidget(scroll)
+
+        # Boutons
+        btn_layout = QHBoxLayout()
+        browse_btn = QPushButton("Autre fichier...")
+        browse_btn.clicked.connect(self.browse_file)
+        cancel_btn = QPushButton("Annuler")
+        cancel_btn.clicked.connect(self.reject)
+        btn_layout.addWidget(browse_btn)
+        btn_layout.addWidget(cancel_btn)
+        layout.addLayout(btn_layout)
+
+        self.setLayout(layout)
+
+    def choose(self, path):
+        self.selected_path = path
+        self.accept()
+
+    def browse_file(self):
+        """Choisir un fichier hors de la grille, avec le dialogue de fichiers"""
+        path = self.browse()
+        if path:
+            self.choose(path)
+
+    def set_thumbnail(self, path, thumbnail):
+        """Miniature générée pendant que le choix est ouvert"""
+        button = self.buttons.get(path)
+        if button and thumbnail:
+            button.setIcon(QIcon(thumbnail))
+
+
+class FrameProfiler:
+    """Mesures par image : durée de chaque étape du rendu et latence stylet -> affichage
+
+    Les enregistrements sont ajoutés par le thread de rendu et lus par l'interface (deque, sans verrou).
+    Seuls comptent les affichages qui recouvrent une zone publiée par le rendu (frame_ready) : ceux du
+    curseur, des mesures ou de la progression ne sont pas des images.
+    """
+
+    STAGES = ('interpolation', 'particules', 'calque', 'composition', 'publication', 'affichage')
+    CSV_FIELDS = ('image', 'positions', 'jets') + STAGES + ('latence',)
+
+    def __init__(self, max_records=3600):
+        self.records = deque(maxlen=max_records)  # Environ une minute à 60 images/s
+        self.unpainted = deque()  # Images rendues pas encore affichées : (enregistrement, zone restant à afficher)
+        self.published = deque()  # Zones publiées par le rendu, pas encore affichées
+        self.paint_ends = deque(maxlen=240)
+        self.frame_count = 0
+        # Décalage entre l'horloge des événements Qt et perf_counter, estimé au plus petit écart vu
+        self.clock_offset = None
+        self.visible = False
+
+    @staticmethod
+    def now():
+        return time.perf_counter() * 1000
+
+    def input_event(self, timestamp):
+        """Noter l'arrivée d'un événement du stylet (timestamp Qt en ms)"""
+        offset = self.now() - timestamp
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+
+    def frame_rendered(self, record, rects):
+        """Enregistrer une image rendue par le thread de rendu (durées des étapes en ms, zones modifiées)"""
+        self.frame_count += 1
+        record['image'] = self.frame_count
+        self.records.append(record)
+        if rects:
+            region = QRegion()
+            for rect in rects:
+                region = region.united(rect)
+            self.unpainted.append((record, region))
+
+    def frame_published(self, rects):
+        """Noter les zones que le thread de rendu publie (avant frame_ready)"""
+        self.published.extend(rects)
+        while len(self.published) > 240:
+            self.published.popleft()  # Jamais affichées (fenêtre cachée...)
+
+    def frame_painted(self, region, paint_ms):
+        """Affichage terminé pour region : les images rendues dont toute la zone a été affichée sont à l'écran"""
+        # Le thread de rendu peut ajouter pendant ce temps : ne traiter que les éléments déjà présents
+        waiting = [self.published.popleft() for _ in range(len(self.published))]
+        remaining = [rect for rect in waiting if not region.intersects(rect)]
+        self.published.extendleft(reversed(remaining))
+        if len(remaining) == len(waiting):
+            return
+
+        end = self.now()
+        self.paint_ends.append(end)
+        kept = []
+        for _ in range(len(self.unpainted)):
+            record, unpainted = self.unpainted.popleft()
+            unpainted = unpainted.subtracted(region)
+            if not unpainted.isEmpty():
+                kept.append((record, unpainted))
+                continue
+            record['affichage'] = paint_ms
+            if record.get('event') is not None and self.clock_offset is not None:
+                record['latence'] = end - (record['event'] + self.clock_offset)
+        self.unpainted.extendleft(reversed(kept))
+
+    def fps(self):
+        """Images affichées pendant la dernière seconde"""
+        now = self.now()
+        return sum(1 for end in self.paint_ends if now - end <= 1000)
+
+    def summary(self, count=60):
+        """Moyenne des étapes et latence p50/p95 sur les dernières images"""
+        recent = list(self.records)[-count:]
+        stages = {stage: sum(r.get(stage, 0) for r in recent) / len(recent) if recent else 0
+                  for stage in self.STAGES}
+        latencies = sorted(r['latence'] for r in recent if 'latence' in r)
+        if latencies:
+            latency = (latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)])
+        else:
+            latency = None
+        return stages, latency
+
+    def export_csv(self, path):
+        """Écrire les enregistrements par image dans un fichier CSV"""
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.CSV_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for record in list(self.records):
+                writer.writerow({field: (round(value, 3) if isinstance(value, float) else value)
+                                 for field, value in record.items()})
+
+
+class InputRecorder:
+    """Enregistrement des événements bruts du stylet vus par le canvas (appui, mouvement, relâchement)
+
+    Format compact : fichier gzip, une ligne JSON d'en-tête puis une liste JSON par événement,
+    [type, t (ms depuis le début), ...]. Les marques d'image ('f') notent les lots dessinés à chaque
+    image, pour que le rejeu découpe les traits exactement de la même façon.
+    """
+
+    PRESS, MOVE, RELEASE, FRAME, ACTION = 'p', 'm', 'r', 'f', 'a'
+    VERSION = 1
+
+    def __init__(self):
+        self.header = None
+        self.events = []
+        self.start_time = 0.0
+
+    @property
+    def recording(self):
+        return self.header is not None
+
+    def elapsed(self):
+        return round((time.perf_counter() - self.start_time) * 1000, 1)
+
+    def start(self, app):
+        """Commencer un enregistrement : la graine des traits est fixée pour un rejeu identique au pixel près"""
+        seed = int.from_bytes(os.urandom(4), 'little')
+        app.render_worker.wait_idle()
+        app.engine.set_random_seed(seed)
+        self.header = {
+            'version': self.VERSION,
+            'size': list(app.engine.size),
+            'seed': seed,
+            'bars': [app.top_bar_visible, app.right_bar_visible],
+            'date': datetime.now().isoformat(timespec='seconds'),
+        }
+        self.events = []
+        self.start_time = time.perf_counter()
+
+    def record_press(self, event, app):
+        """Appui : position, bouton et outil actif (couleur, taille, opacité, gomme)"""
+        self.events.append([self.PRESS, self.elapsed(), event.x(), event.y(), int(event.button()),
+                            app.spray_color, app.spray_size, app.spray_opacity, app.eraser_mode])
+
+    def record_move(self, event):
+        self.events.append([self.MOVE, self.elapsed(), event.x(), event.y(), int(event.buttons())])
+
+    def record_release(self, event):
+        self.events.append([self.RELEASE, self.elapsed(), event.x(), event.y(), int(event.button())])
+
+    def record_frame(self):
+        self.events.append([self.FRAME, self.elapsed()])
+
+    def record_action(self, name):
+        """Commande hors canvas qui modifie le dessin ('undo', 'redo', 'clear')"""
+        self.events.append([self.ACTION, self.elapsed(), name])
+
+    def stop(self, path):
+        """Terminer l'enregistrement et l'écrire dans path"""
+        header, events = self.header, self.events
+        self.header, self.events = None, []
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            for event in events:
+                f.write(json.dumps(event, separators=(',', ':')) + '\n')
+        return len(events)
+
+    @staticmethod
+    def load(path):
+        """Lire un enregistrement, retourne (en-tête, événements)"""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            events = [json.loads(line) for line in f if line.strip()]
+        return header, events
+
+
+class InputReplayer:
+    """Rejeu d'un enregistrement dans le canvas, au rythme d'origine ou à vitesse maximale
+
+    Les événements Qt sont recréés et envoyés au canvas ; l'horloge des images est suspendue et les
+    lots sont dessinés aux marques d'image enregistrées.
+    """
+
+    def __init__(self, app, path, max_speed=False, on_finished=None):
+        self.app = app
+        self.path = path
+        self.max_speed = max_speed
+        self.on_finished = on_finished
+        self.header, self.events = InputRecorder.load(path)
+        self.index = 0
+        self.frames = 0
+        self.start_time = 0.0
+        self.duration = 0.0
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.step)
+
+    @property
+    def running(self):
+        return bool(self.start_time) and not self.duration
+
+    def start(self):
+        app = self.app
+        if tuple(self.header['size']) != app.engine.size:
+            print(f"Avertissement: enregistrement fait en {self.header['size'][0]}x{self.header['size'][1]}, "
+                  f"canvas en {app.engine.size[0]}x{app.engine.size[1]} : le dessin peut différer")
+        if [app.top_bar_visible, app.right_bar_visible] != self.header['bars']:
+            if app.top_bar_visible != self.header['bars'][0]:
+                app.toggle_top_bar()
+            if app.right_bar_visible != self.header['bars'][1]:
+                app.toggle_right_bar()
+        app.render_worker.wait_idle()
+        app.engine.set_random_seed(self.header['seed'])
+        # Les images sont dessinées aux marques enregistrées, pas par l'horloge à 60 Hz
+        app.frame_timer.blockSignals(True)
+        app.profiler.clock_offset = None
+        pace = "vitesse maximale" if self.max_speed else "rythme d'origine"
+        print(f"Rejeu de {os.path.basename(self.path)} ({len(self.events)} événements, {pace})")
+        self.start_time = time.perf_counter()
+        self.timer.start(0)
+
+    def step(self):
+        """Envoyer les événements dus ; à vitesse maximale, par paquets pour laisser Qt afficher"""
+        elapsed = (time.perf_counter() - self.start_time) * 1000
+        budget = 200
+        while self.index < len(self.events):
+            event = self.events[self.index]
+            if self.max_speed:
+                if budget == 0:
+                    break
+                budget -= 1
+            elif event[1] > elapsed:
+                break
+            self.dispatch(event)
+            self.index += 1
+
+        if self.index < len(self.events):
+            delay = 0 if self.max_speed else max(0, int(self.events[self.index][1] - elapsed))
+            self.timer.start(delay)
+        else:
+            self.finish()
+
+    def dispatch(self, event):
+        app, canvas = self.app, self.app.canvas
+        kind = event[0]
+        if kind == InputRecorder.PRESS:
+            self.apply_tool(*event[5:9])
+            self.send(QEvent.MouseButtonPress, event[2], event[3], event[4], event[4])
+        elif kind == InputRecorder.MOVE:
+            self.send(QEvent.MouseMove, event[2], event[3], Qt.NoButton, event[4])
+        elif kind == InputRecorder.RELEASE:
+            self.send(QEvent.MouseButtonRelease, event[2], event[3], event[4], Qt.NoButton)
+        elif kind == InputRecorder.FRAME:
+            self.frames += 1
+            app.render_frame(force=True)
+        elif kind == InputRecorder.ACTION:
+            if event[2] == 'clear':
+                app.render_worker.submit(('clear',))
+            elif not canvas.drawing:
+                app.render_worker.submit((event[2],))
+
+    def send(self, kind, x, y, button, buttons):
+        mouse_event = QMouseEvent(kind, QPointF(x, y), Qt.MouseButton(button), Qt.MouseButtons(buttons),
+                                  Qt.NoModifier)
+        mouse_event.setTimestamp(int(FrameProfiler.now()))
+        QApplication.sendEvent(self.app.canvas, mouse_event)
+
+    def apply_tool(self, color, size, opacity, eraser):
+        """Remettre l'outil actif au moment de l'appui enregistré"""
+        app = self.app
+        app.spray_color = color
+        app.spray_size = size
+        if size in app.size_levels:
+            app.current_size_index = app.size_levels.index(size)
+        if opacity != app.spray_opacity:
+            app.spray_opacity = opacity
+            if opacity in app.opacity_levels:
+                app.current_opacity_index = app.opacity_levels.index(opacity)
+            app.opacity_label.setText(f"{opacity}%")
+        if eraser != app.eraser_mode:
+            app.toggle_eraser()
+
+    def finish(self):
+        app = self.app
+        app.render_worker.wait_idle()
+        self.duration = time.perf_counter() - self.start_time
+        app.frame_timer.blockSignals(False)
+        app.profiler.clock_offset = None
+        stages, latency = app.profiler.summary(count=self.frames or 1)
+        print(f"Rejeu terminé en {self.duration:.2f} s ({self.frames} images)")
+        if latency:
+            print(f"  latence p50 {latency[0]:.1f} ms, p95 {latency[1]:.1f} ms")
+        print("  " + ", ".join(f"{stage} {value:.2f} ms" for stage, value in stages.items()))
+        print(f"  empreinte du dessin : {self.digest()}")
+        if self.on_finished:
+            self.on_finished(self)
+
+    def digest(self):
+        """Empreinte SHA-256 de la couche de dessin, pour vérifier un rejeu identique au pixel près"""
+        with self.app.engine.layer_lock:
+            return hashlib.sha256(self.app.engine.drawing_layer.tobytes()).hexdigest()
+
+
+class ImageSaver(QThread):
+    """Composition et encodage d'une image en arrière-plan, à partir d'un instantané des couches"""
+
+    progress = pyqtSignal(int, str)
+    saved = pyqtSignal(str, float)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, snapshot, path, opaque, png_compression):
+        super().__init__()
+        self.snapshot = snapshot
+        self.path = path
+        self.opaque = opaque
+        self.png_compression = png_compression
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.progress.emit(0, "composition")
+            image = SprayEngine.compose_snapshot(
+                self.snapshot, band_height=64,
+                progress=lambda fraction: self.progress.emit(int(fraction * 30), "composition"))
+            self.snapshot = None
+            if self.opaque:
+                # Fond inclus : image opaque, enregistrée en RGB
+                self.progress.emit(30, "conversion")
+                image = image.convert('RGB')
+            image_format, _ = SprayEngine.save_options(self.path)
+            self.progress.emit(40, f"encodage {image_format}")
+            SprayEngine.save_image(image, self.path, self.png_compression)
+        except Exception as e:
+            self.failed.emit(self.path, str(e))
+            return
+        self.progress.emit(100, "terminée")
+        self.saved.emit(self.path, time.perf_counter() - start)
+
+
+class AssetLoader(QThread):
+    """Décodage d'un fichier (fond, modèle) hors du thread de l'interface : load() est appelé dans le thread"""
+
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, load):
+        super().__init__()
+        self.load = load
+
+    def run(self):
+        try:
+            result = self.load()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.loaded.emit(result)
+
+
+class RenderWorker(QThread):
+    """Thread de rendu : fait avancer le moteur de peinture et publie les images du canvas"""
+
+    frame_ready = pyqtSignal(QRect)
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.jobs = queue.Queue()
+        # Lots de positions envoyés (écrit par l'interface) et terminés (écrit par ce thread)
+        self.batches_sent = 0
+        self.batches_done = 0
+
+    def submit(self, job):
+        """Envoyer un travail au thread de rendu : ('begin', params), ('points', lot), ('end',),
+        ('undo',), ('redo',), ('clear',) ou ('refresh', box)"""
+        if job[0] == 'points':
+            self.batches_sent += 1
+        self.jobs.put(job)
+
+    def batch_in_flight(self):
+        """Un lot de positions est-il encore en cours de rendu ?"""
+        return self.batches_sent != self.batches_done
+
+    def wait_idle(self):
+        """Attendre que tous les travaux envoyés soient rendus"""
+        self.jobs.join()
+
+    def stop(self):
+        """Terminer le thread après les travaux en attente"""
+        self.jobs.put(None)
+        self.wait()
+
+    def run(self):
+        """Boucle du thread : traiter les travaux dans l'ordre d'arrivée"""
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                engine = self.app.engine
+                with engine.layer_lock:
+                    if job[0] == 'points':
+                        # Un lot de jets peut toucher plusieurs tuiles éloignées : chacune est recomposée seule
+                        boxes = engine.add_points(job[1])
+                        record = dict(job[2], positions=len(job[1]), **engine.stage_times)
+                    elif job[0] == 'begin':
+                        engine.begin_stroke(**job[1])
+                        boxes = []
+                    elif job[0] == 'end':
+                        engine.end_stroke()
+                        boxes = []
+                    elif job[0] == 'undo':
+                        boxes = [engine.undo()]
+                    elif job[0] == 'redo':
+                        boxes = [engine.redo()]
+                    elif job[0] == 'clear':
+                        boxes = [engine.clear()]
+                    else:
+                        boxes = [job[1]]
+                    boxes = [box for box in boxes if box]
+                    presented = [self.app.present_region(box) for box in boxes]
+                rects = [QRect(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in boxes]
+                if job[0] == 'points':
+                    record['composition'] = sum(compose for compose, _ in presented)
+                    record['publication'] = sum(publish for _, publish in presented)
+                    self.app.profiler.frame_rendered(record, rects)
+                self.app.profiler.frame_published(rects)
+                for rect in rects:
+                    self.frame_ready.emit(rect)
+            except Exception as e:
+                print(f"Erreur dans le thread de rendu: {e}")
+            finally:
+                if job is not None and job[0] == 'points':
+                    self.batches_done += 1
+                self.jobs.task_done()
+
+
 class DrawingCanvas(QWidget):
     """Widget de dessin personnalisé"""
 
@@ -121,64 +703,167 @@ class DrawingCanvas(QWidget):
         self.drawing = False
         self.last_point = QPoint()
         self.cursor_pos = QPoint()
+        self.cursor_rect = QRect()  # Zone du curseur affiché (vide s'il est caché)
+        self.hud_rect = QRect(10, 10, 330, 150)  # Zone des mesures de performance (F3)
+
+        # Progression de la sauvegarde en arrière-plan, en bas à gauche
+        self.status_text = None
+        self.status_percent = 0
+        self.status_rect = QRect()
+        self.status_timer = QTimer(self)
+        self.status_timer.setSingleShot(True)
+        self.status_timer.timeout.connect(lambda: self.set_status(None))
 
     def init_image(self):
-        """Initialiser l'image de dessin"""
+        """Initialiser l'image de dessin (double tampon : image affichée + image de rendu)"""
+        self.buffer_lock = threading.Lock()
         try:
-            self.image = QImage(1920, 1080, QImage.Format_ARGB32)
-            # Remplir avec du blanc
-            self.image.fill(Qt.white)
-            # Initialiser la couche de dessin du parent
-            if self.parent:
-                self.parent.drawing_layer = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
+            # Tampons à la résolution native du moteur de peinture
+            width, height = self.parent.engine.size if self.parent else SprayEngine.REFERENCE_SIZE
+            self.pixels, self.image = self.create_buffer(width, height)
+            self.back_pixels, self.back_image = self.create_buffer(width, height)
         except Exception as e:
             print(f"Erreur lors de la création de l'image: {e}")
             # Fallback avec une taille plus petite
-            self.image = QImage(800, 600, QImage.Format_ARGB32)
-            self.image.fill(Qt.white)
-            if self.parent:
-                self.parent.drawing_layer = Image.new('RGBA', (800, 600), (0, 0, 0, 0))
+            self.pixels, self.image = self.create_buffer(800, 600)
+            self.back_pixels, self.back_image = self.create_buffer(800, 600)
+
+    @staticmethod
+    def create_buffer(width, height):
+        """Créer un tampon de pixels NumPy (BGRA, blanc) et la QImage qui le lit sans copie
+
+        ARGB32_Premultiplied est le format que Qt dessine sans conversion ; le canvas
+        étant opaque, les valeurs prémultipliées sont les valeurs directes.
+        """
+        pixels = np.full((height, width, 4), 255, dtype=np.uint8)
+        image = QImage(pixels.data, width, height, width * 4, QImage.Format_ARGB32_Premultiplied)
+        return pixels, image
+
+    def publish_region(self, box, render):
+        """Publier une zone (thread de rendu) : rendu en place dans le tampon arrière, échange, resynchronisation
+
+        render(view) écrit directement les pixels BGRA de la zone dans la vue reçue.
+        """
+        x0, y0, x1, y1 = box
+        render(self.back_pixels[y0:y1, x0:x1])
+        with self.buffer_lock:
+            self.pixels, self.back_pixels = self.back_pixels, self.pixels
+            self.image, self.back_image = self.back_image, self.image
+        # L'ancien tampon avant devient le tampon arrière : lui recopier la même zone
+        self.back_pixels[y0:y1, x0:x1] = self.pixels[y0:y1, x0:x1]
 
     def paintEvent(self, event):
         """Dessiner le canvas"""
         if self.image is None:
             return
 
+        start = time.perf_counter()
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.Antialiasing)
 
-        # Dessiner l'image
-        painter.drawImage(0, 0, self.image)
-
-        # Dessiner le curseur personnalisé (cercle de prévisualisation)
+        # Présenter la dernière image terminée, uniquement dans la partie à rafraîchir
+        dirty_rect = event.rect()
+        with self.buffer_lock:
+            painter.drawImage(dirty_rect, self.image, dirty_rect)
+
+        # Dessiner le curseur personnalisé (cercle de prévisualisation), s'il touche la zone à rafraîchir
+        if not self.cursor_rect.isNull() and self.cursor_rect.intersects(dirty_rect):
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(QPen(QColor(self.parent.spray_color), 2))
+            painter.setBrush(Qt.NoBrush)
+
+            # Cercle
+            radius = self.parent.spray_size
+            painter.drawEllipse(self.cursor_pos, radius, radius)
+
+            # Croix
+            painter.drawLine(self.cursor_pos.x() - 5, self.cursor_pos.y(),
+                             self.cursor_pos.x() + 5, self.cursor_pos.y())
+            painter.drawLine(self.cursor_pos.x(), self.cursor_pos.y() - 5,
+                             self.cursor_pos.x(), self.cursor_pos.y() + 5)
+
+        if self.parent:
+            profiler = self.parent.profiler
+            if profiler.visible and self.hud_rect.intersects(dirty_rect):
+                self.draw_hud(painter, profiler)
+            if self.status_text and self.status_rect.intersects(dirty_rect):
+                self.draw_status(painter)
+            profiler.frame_painted(event.region(), (time.perf_counter() - start) * 1000)
+
+    def draw_hud(self, painter, profiler):
+        """Dessiner les mesures de performance : images/s, durée moyenne des étapes et latence"""
+        stages, latency = profiler.summary()
+        lines = [f"{profiler.fps()} images/s"]
+        lines += [f"{stage:<13} {stages[stage]:6.2f} ms" for stage in profiler.STAGES]
+        if latency:
+            lines.append(f"latence p50 {latency[0]:.1f} ms  p95 {latency[1]:.1f} ms")
+
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        painter.fillRect(self.hud_rect, QColor(0, 0, 0, 170))
+        painter.setPen(QColor(255, 255, 255))
+        painter.setFont(QFont("Consolas", 10))
+        for i, line in enumerate(lines):
+            painter.drawText(self.hud_rect.x() + 10, self.hud_rect.y() + 20 + i * 16, line)
+
+    def set_status(self, text, percent=None, hide_after=None):
+        """Afficher (ou masquer si text est None) la progression d'une tâche de fond (sans barre si percent est None)"""
+        self.status_timer.stop()
+        self.status_text = text
+        self.status_percent = percent
+        self.status_rect = QRect(10, self.height() - 56, 330, 46)
+        self.update(self.status_rect)
+        if hide_after:
+            self.status_timer.start(hide_after)
+
+    def draw_status(self, painter):
+        """Dessiner le texte et la barre de progression de la tâche de fond"""
+        rect = self.status_rect
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        painter.fillRect(rect, QColor(0, 0, 0, 170))
+        painter.setPen(QColor(255, 255, 255))
+        painter.setFont(QFont("Arial", 10))
+        if self.status_percent is None:
+            painter.drawText(rect.x() + 10, rect.y() + 28, self.status_text)
+            return
+        painter.drawText(rect.x() + 10, rect.y() + 18, f"{self.status_text}  {self.status_percent} %")
+        bar = QRect(rect.x() + 10, rect.y() + 28, rect.width() - 20, 8)
+        painter.fillRect(bar, QColor(255, 255, 255, 60))
+        painter.fillRect(QRect(bar.x(), bar.y(), bar.width() * self.status_percent // 100, bar.height()),
+                         QColor(74, 158, 255))
+
+    def update_cursor(self):
+        """Déplacer le curseur en ne rafraîchissant que son ancienne et sa nouvelle zone"""
         # Seulement si on n'est pas en train de dessiner et pas dans une zone protégée
-        if not self.drawing and self.cursor_pos and self.parent:
-            # Ne pas afficher le curseur dans les zones protégées
-            if not self.is_in_protected_zone(self.cursor_pos):
-                painter.setPen(QPen(QColor(self.parent.spray_color), 2))
-                painter.setBrush(Qt.NoBrush)
-
-                # Cercle
-                radius = self.parent.spray_size
-                painter.drawEllipse(self.cursor_pos, radius, radius)
-
-                # Croix
-                painter.drawLine(self.cursor_pos.x() - 5, self.cursor_pos.y(),
-                                 self.cursor_pos.x() + 5, self.cursor_pos.y())
-                painter.drawLine(self.cursor_pos.x(), self.cursor_pos.y() - 5,
-                                 self.cursor_pos.x(), self.cursor_pos.y() + 5)
+        if self.drawing or not self.parent or self.is_in_protected_zone(self.cursor_pos):
+            new_rect = QRect()
+        else:
+            # Cercle de rayon spray_size, plus l'épaisseur du trait antialiasé
+            margin = max(self.parent.spray_size, 5) + 3
+            new_rect = QRect(self.cursor_pos.x() - margin, self.cursor_pos.y() - margin,
+                             2 * margin + 1, 2 * margin + 1)
+
+        if not self.cursor_rect.isNull():
+            self.update(self.cursor_rect)
+        if not new_rect.isNull():
+            self.update(new_rect)
+        self.cursor_rect = new_rect
 
     def mousePressEvent(self, event):
         """Démarrer le dessin"""
+        if self.parent.input_recorder.recording:
+            self.parent.input_recorder.record_press(event, self.parent)
         if event.button() == Qt.LeftButton:
             # Vérifier si le clic n'est pas dans la zone des menus ou boutons
             if not self.is_in_protected_zone(event.pos()):
                 self.drawing = True
                 self.last_point = event.pos()
                 self.parent.start_spray(event.pos())
+                # Effacer le cercle de prévisualisation
+                self.update_cursor()
 
     def mouseMoveEvent(self, event):
         """Continuer le dessin ou mettre à jour le curseur"""
+        if self.parent.input_recorder.recording:
+            self.parent.input_recorder.record_move(event)
         self.cursor_pos = event.pos()
 
         if self.drawing:
@@ -188,121 +873,38 @@ class DrawingCanvas(QWidget):
                 self.drawing = False
                 self.parent.stop_spray()
             else:
-                # Sinon, continuer à dessiner normalement
-                self.parent.spray_paint(event.pos())
+                # Sinon, mettre la position en file : elle sera dessinée à la prochaine image
+                self.parent.queue_spray_point(event.pos(), event.timestamp())
+                return
 
-        self.update()
+        self.update_cursor()
 
     def is_in_deployed_menu(self, pos):
         """Vérifier si la position est dans un menu DÉPLOYÉ (pas les boutons)"""
         if not self.parent:
             return False
-
-        # Convertir la position du canvas vers les coordonnées de la fenêtre parent
-        parent_pos = self.mapTo(self.parent, pos)
-
-        # Menu du haut déployé
-        if hasattr(self.parent, 'top_bar_visible') and self.parent.top_bar_visible:
-            if hasattr(self.parent, 'top_bar_content'):
-                content_global_pos = self.parent.top_bar_content.mapTo(self.parent, QPoint(0, 0))
-                content_rect = QRect(
-                    content_global_pos.x(),
-                    content_global_pos.y(),
-                    self.parent.top_bar_content.width(),
-                    self.parent.top_bar_content.height()
-                )
-                if content_rect.contains(parent_pos):
-                    return True
-
-        # Menu de droite déployé
-        if hasattr(self.parent, 'right_bar_visible') and self.parent.right_bar_visible:
-            if hasattr(self.parent, 'right_bar_content'):
-                content_global_pos = self.parent.right_bar_content.mapTo(self.parent, QPoint(0, 0))
-                content_rect = QRect(
-                    content_global_pos.x(),
-                    content_global_pos.y(),
-                    self.parent.right_bar_content.width(),
-                    self.parent.right_bar_content.height()
-                )
-                if content_rect.contains(parent_pos):
-                    return True
-
-        return False
+        return self.parent.deployed_menu_region.contains(pos)
 
     def is_in_protected_zone(self, pos):
         """Vérifier si la position est dans une zone protégée (pour les clics initiaux)"""
         if not self.parent:
             return False
-
-        # Convertir la position du canvas vers les coordonnées de la fenêtre parent
-        parent_pos = self.mapTo(self.parent, pos)
-
-        # Protection du menu du haut
-        if hasattr(self.parent, 'top_bar_visible') and hasattr(self.parent, 'top_bar'):
-            if self.parent.top_bar_visible:
-                # Menu déployé : protéger tout le contenu visible
-                if hasattr(self.parent, 'top_bar_content'):
-                    content_global_pos = self.parent.top_bar_content.mapTo(self.parent, QPoint(0, 0))
-                    content_rect = QRect(
-                        content_global_pos.x(),
-                        content_global_pos.y(),
-                        self.parent.top_bar_content.width(),
-                        self.parent.top_bar_content.height()
-                    )
-                    if content_rect.contains(parent_pos):
-                        return True
-
-            # Toujours protéger le bouton toggle du haut
-            if hasattr(self.parent, 'top_toggle_btn'):
-                btn_global_pos = self.parent.top_toggle_btn.mapTo(self.parent, QPoint(0, 0))
-                btn_rect = QRect(
-                    btn_global_pos.x(),
-                    btn_global_pos.y(),
-                    self.parent.top_toggle_btn.width(),
-                    self.parent.top_toggle_btn.height()
-                )
-                if btn_rect.contains(parent_pos):
-                    return True
-
-        # Protection du menu de droite
-        if hasattr(self.parent, 'right_bar_visible') and hasattr(self.parent, 'right_bar'):
-            if self.parent.right_bar_visible:
-                # Menu déployé : protéger tout le contenu visible
-                if hasattr(self.parent, 'right_bar_content'):
-                    content_global_pos = self.parent.right_bar_content.mapTo(self.parent, QPoint(0, 0))
-                    content_rect = QRect(
-                        content_global_pos.x(),
-                        content_global_pos.y(),
-                        self.parent.right_bar_content.width(),
-                        self.parent.right_bar_content.height()
-                    )
-                    if content_rect.contains(parent_pos):
-                        return True
-
-            # Toujours protéger le bouton toggle de droite - POSITION EXACTE
-            if hasattr(self.parent, 'right_toggle_btn'):
-                # Obtenir la position réelle du bouton dans la fenêtre
-                btn_global_pos = self.parent.right_toggle_btn.mapTo(self.parent, QPoint(0, 0))
-                btn_rect = QRect(
-                    btn_global_pos.x(),
-                    btn_global_pos.y(),
-                    self.parent.right_toggle_btn.width(),
-                    self.parent.right_toggle_btn.height()
-                )
-                if btn_rect.contains(parent_pos):
-                    return True
-
-        return False
+        return self.parent.protected_region.contains(pos)
 
     def mouseReleaseEvent(self, event):
         """Arrêter le dessin"""
+        if self.parent.input_recorder.recording:
+            self.parent.input_recorder.record_release(event)
         if event.button() == Qt.LeftButton:
             self.drawing = False
             self.parent.stop_spray()
 
 
 class SprayPaintApp(QMainWindow):
-    def __init__(self):
+    # Miniature générée par l'index des fichiers (émis depuis ses threads) : type, chemin
+    thumbnail_ready = pyqtSignal(str, str)
+
+    def __init__(self, autosave=True):
         super().__init__()
 
         # Initialiser pygame pour l'audio de manière plus sûre
@@ -316,37 +918,76 @@ class SprayPaintApp(QMainWindow):
         else:
             self.pygame_available = True
 
-        # Variables de dessin
-        self.spray_color = "#E74C3C"
-        self.spray_size = 100
-        self.spray_opacity = 100
+        # Moteur de peinture (couches, pinceau, composition, historique) à la résolution native de l'écran
+        self.max_history = 50
+        self.history_budget = 256 * 1024 * 1024  # Mémoire maximale de l'historique, en octets
+        self.engine = SprayEngine(self.detect_canvas_size(), max_history=self.max_history,
+                                  history_budget=self.history_budget)
 
         # Paliers
-        self.size_levels = [20, 60, 100, 140, 180, 220]
+        self.size_levels = [self.engine.scaled(size) for size in (20, 60, 100, 140, 180, 220)]
         self.current_size_index = 2
 
+        # Variables de dessin
+        self.spray_color = "#E74C3C"
+        self.spray_size = self.size_levels[self.current_size_index]
+        self.spray_opacity = 100
+
         self.opacity_levels = [50, 60, 70, 80, 90, 100]
         self.current_opacity_index = 5
 
-        # Images
-        self.background_image = None
-        self.template_image = None
-        self.template_position = (725, 540)
-
-        # Couche de dessin séparée (pour isoler le dessin du fond/modèle)
-        self.drawing_layer = None
+        self.render_worker = None
 
         # Audio
         self.spray_sound = None
         self.sound_channel = None
 
+        # File des positions du stylet, dessinées à cadence fixe (60 images/s)
+        self.pending_points = []
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setInterval(1000 // 60)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.render_frame)
+
+        # Mesures par image et affichage de performance (F3), export CSV (F4)
+        self.profiler = FrameProfiler()
+        self.hud_timer = QTimer(self)
+        self.hud_timer.setInterval(250)
+        self.hud_timer.timeout.connect(lambda: self.canvas.update(self.canvas.hud_rect))
+
+        # Sauvegardes en cours (composition et encodage en arrière-plan)
+        self.image_savers = []
+
+        # Décodages en cours et cache disque des images prétraitées (fonds à la résolution de l'écran)
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.asset_loaders = []
+        self.asset_cache = AssetCache(os.path.join(base_dir, "cache"))
+        # Index de fonds/, modeles/ et sons/ : miniatures générées en arrière-plan dès le démarrage
+        self.asset_index = AssetIndex(base_dir, os.path.join(base_dir, "cache"),
+                                      on_thumbnail=lambda kind, path: self.thumbnail_ready.emit(kind, path))
+        self.asset_index.scan()
+        self.background_request = None
+        self.template_request = None
+        # Suppression du fond des modèles : False = toute la couleur des coins, True = seulement le fond relié aux coins
+        self.template_flood_fill = False
+
+        # Sauvegarde automatique des tuiles modifiées du dessin, proposée à la restauration au démarrage
+        self.autosave_enabled = autosave
+        self.autosave_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "save",
+                                          "session_autosave.dat")
+        self.session_store = None
+        self.autosave_thread = None
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setInterval(5000)
+        self.autosave_timer.timeout.connect(self.autosave)
+
+        # Enregistrement des événements du stylet (F5) et rejeu d'un enregistrement (F6)
+        self.input_recorder = InputRecorder()
+        self.replayer = None
+
         # Mode gomme
         self.eraser_mode = False
 
-        # Historique
-        self.history = []  # Contiendra des tuples (canvas_image, drawing_layer)
-        self.max_history = 50
-
         # Détection position
         self.last_valid_position = None
         self.position_not_detected_count = 0  # Compteur pour détecter les problèmes de stylet
@@ -357,6 +998,10 @@ class SprayPaintApp(QMainWindow):
         self.top_bar_animation = None
         self.right_bar_animation = None
 
+        # Zones des barres en coordonnées du canvas, recalculées quand leur géométrie change
+        self.deployed_menu_region = QRegion()  # Menus déployés
+        self.protected_region = QRegion()  # Menus déployés + boutons toggle
+
         # Palette de couleurs
         self.color_palette = [
             "#E74C3C", "#E67E22", "#F1C40F", "#2ECC71",
@@ -365,6 +1010,9 @@ class SprayPaintApp(QMainWindow):
             "#95A5A6", "#34495E", "#F39C12", "#ECF0F1"
         ]
 
+        # Masques de la gomme et banques de jets (en arrière-plan), en commençant par la taille actuelle
+        self.engine.warm(sorted(self.size_levels, key=lambda size: size != self.spray_size), self.opacity_levels)
+
         self.init_ui()
         self.setup_screen()
 
@@ -397,8 +1045,10 @@ class SprayPaintApp(QMainWindow):
         self.canvas.show()
         print("Canvas créé")
 
-        # Initialiser l'historique avec l'état de départ
-        self.save_state()
+        # Thread de rendu : rastérisation et composition hors du thread de l'interface
+        self.render_worker = RenderWorker(self)
+        self.render_worker.frame_ready.connect(self.canvas.update)
+        self.render_worker.start()
 
         # Barre supérieure (overlay en haut à droite)
         print("Création de la barre supérieure...")
@@ -420,6 +1070,10 @@ class SprayPaintApp(QMainWindow):
         QTimer.singleShot(50, self.position_overlays)
         print("Widgets créés")
 
+        if self.autosave_enabled:
+            # Après le placement des barres : la question de restauration apparaît par-dessus
+            QTimer.singleShot(100, self.start_autosave)
+
     def position_overlays(self):
         """Positionner les barres d'outils en overlay"""
         # Obtenir la taille de la barre droite
@@ -443,6 +1097,33 @@ class SprayPaintApp(QMainWindow):
             right_bar_width,  # largeur
             right_bar_height  # hauteur
         )
+        self.update_hit_regions()
+
+    def widget_rect_in_canvas(self, widget):
+        """Rectangle d'un widget des barres, en coordonnées du canvas"""
+        top_left = widget.mapTo(self.centralWidget(), QPoint(0, 0)) - self.canvas.pos()
+        return QRect(top_left, widget.size())
+
+    def update_hit_regions(self):
+        """Recalculer les zones des menus et des boutons toggle testées à chaque événement du stylet"""
+        if not (hasattr(self, 'canvas') and hasattr(self, 'top_bar') and hasattr(self, 'right_bar')):
+            return
+
+        # Appliquer tout de suite les layouts pour lire la géométrie à jour des contenus
+        self.top_bar.layout().activate()
+        self.right_bar.layout().activate()
+
+        deployed = QRegion()
+        if self.top_bar_visible:
+            deployed += QRegion(self.widget_rect_in_canvas(self.top_bar_content))
+        if self.right_bar_visible:
+            deployed += QRegion(self.widget_rect_in_canvas(self.right_bar_content))
+        self.deployed_menu_region = deployed
+
+        # Les boutons toggle sont toujours protégés
+        self.protected_region = (deployed
+                                 + QRegion(self.widget_rect_in_canvas(self.top_toggle_btn))
+                                 + QRegion(self.widget_rect_in_canvas(self.right_toggle_btn)))
 
     def resizeEvent(self, event):
         """Repositionner les overlays quand la fenêtre change de taille"""
@@ -451,6 +1132,7 @@ class SprayPaintApp(QMainWindow):
             self.canvas.setGeometry(0, 0, self.width(), self.height())
         if hasattr(self, 'top_bar') and hasattr(self, 'right_bar'):
             self.position_overlays()
+        self.update_hit_regions()
 
     def create_top_bar(self):
         """Créer la barre d'outils supérieure avec style métallique"""
@@ -643,7 +1325,7 @@ class SprayPaintApp(QMainWindow):
         # === SECTION 1 : Outils ===
         tools_frame = QWidget()
         tools_frame.setStyleSheet("background: transparent;")
-        tools_layout = QHBoxLayout()
+        tools_layout = QGridLayout()
         tools_layout.setSpacing(10)
 
         btn_undo = QPushButton("↶")
@@ -651,6 +1333,11 @@ class SprayPaintApp(QMainWindow):
         btn_undo.clicked.connect(self.undo)
         btn_undo.setToolTip("Annuler")
 
+        btn_redo = QPushButton("↷")
+        btn_redo.setStyleSheet(tool_button_style)
+        btn_redo.clicked.connect(self.redo)
+        btn_redo.setToolTip("Rétablir")
+
         self.btn_eraser = QPushButton("🧹")
         self.btn_eraser.setStyleSheet(tool_button_style)
         self.btn_eraser.clicked.connect(self.toggle_eraser)
@@ -661,9 +1348,10 @@ class SprayPaintApp(QMainWindow):
         btn_restart.clicked.connect(self.restart_with_background)
         btn_restart.setToolTip("Recommencer")
 
-        tools_layout.addWidget(btn_undo)
-        tools_layout.addWidget(self.btn_eraser)
-        tools_layout.addWidget(btn_restart)
+        tools_layout.addWidget(btn_undo, 0, 0)
+        tools_layout.addWidget(btn_redo, 0, 1)
+        tools_layout.addWidget(self.btn_eraser, 1, 0)
+        tools_layout.addWidget(btn_restart, 1, 1)
         tools_frame.setLayout(tools_layout)
         controls_layout.addWidget(tools_frame)
 
@@ -827,9 +1515,12 @@ class SprayPaintApp(QMainWindow):
         self.top_bar_animation.setDuration(300)  # 300ms
         self.top_bar_animation.setStartValue(self.top_bar_content.height())
         self.top_bar_animation.setEndValue(target_height)
+        self.top_bar_animation.valueChanged.connect(self.update_hit_regions)
+        self.top_bar_animation.finished.connect(self.update_hit_regions)
         self.top_bar_animation.start()
 
         self.top_bar_visible = not self.top_bar_visible
+        self.update_hit_regions()
 
     def toggle_right_bar(self):
         """Afficher/masquer la barre de droite avec animation"""
@@ -850,9 +1541,12 @@ class SprayPaintApp(QMainWindow):
         self.right_bar_animation.setDuration(300)
         self.right_bar_animation.setStartValue(self.right_bar_content.width())
         self.right_bar_animation.setEndValue(target_width)
+        self.right_bar_animation.valueChanged.connect(self.update_hit_regions)
+        self.right_bar_animation.finished.connect(self.update_hit_regions)
         self.right_bar_animation.start()
 
         self.right_bar_visible = not self.right_bar_visible
+        self.update_hit_regions()
 
     def show_message(self, title, message, icon=QMessageBox.Information):
         """Afficher un message avec le bon style"""
@@ -957,6 +1651,13 @@ class SprayPaintApp(QMainWindow):
 
         return msg.exec_() == QMessageBox.Yes
 
+    @staticmethod
+    def detect_canvas_size():
+        """Taille en pixels de l'écran utilisé par setup_screen (le second s'il y en a plusieurs)"""
+        screens = QApplication.instance().screens()
+        geometry = (screens[1] if len(screens) > 1 else screens[0]).geometry()
+        return (geometry.width(), geometry.height())
+
     def setup_screen(self):
         """Configurer l'écran et le plein écran"""
         print("Configuration de l'écran...")
@@ -1017,9 +1718,27 @@ class SprayPaintApp(QMainWindow):
 
     def load_background(self):
         """Charger une image de fond"""
-        # Créer le dossier /fonds s'il n'existe pas
-        fonds_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonds")
-        os.makedirs(fonds_dir, exist_ok=True)
+        file_path = self.choose_asset('fonds', "Choisir une image de fond", "Images (*.png *.jpg *.jpeg *.bmp)")
+        if file_path:
+            self.load_background_file(file_path)
+
+    def choose_asset(self, kind, title, file_filter):
+        """Choisir un fichier de fonds/, modeles/ ou sons/ dans la grille des miniatures (ou en parcourant)"""
+        # Créer le dossier s'il n'existe pas
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), kind)
+        os.makedirs(directory, exist_ok=True)
+
+        # Relister le dossier, et préparer les fichiers à la taille de l'écran pendant le choix :
+        # le fichier choisi est alors affiché directement depuis le cache
+        entries = self.asset_index.scan()[kind]
+        if kind == 'fonds':
+            self.asset_index.preprocess(kind, self.asset_cache, self.engine.background_params(), self.engine.size,
+                                        lambda path: self.engine.decode_background(path, self.asset_cache))
+        elif kind == 'modeles':
+            side = self.engine.template_size
+            self.asset_index.preprocess(kind, self.asset_cache, self.engine.template_params(self.template_flood_fill),
+                                        (side, side), lambda path: self.engine.decode_template(
+                                            path, self.asset_cache, self.template_flood_fill))
 
         # Désactiver les sons Windows temporairement
         try:
@@ -1029,10 +1748,12 @@ class SprayPaintApp(QMainWindow):
         except:
             pass
 
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Choisir une image de fond",
-            fonds_dir, "Images (*.png *.jpg *.jpeg *.bmp)"
-        )
+        picker = AssetPicker(title, entries, self.asset_index.thumbnail_size,
+                             lambda: QFileDialog.getOpenFileName(self, title, directory, file_filter)[0], self)
+        update = lambda _, path: picker.set_thumbnail(path, self.asset_index.thumbnail_path(path))
+        self.thumbnail_ready.connect(update)
+        accepted = picker.exec_() == QDialog.Accepted
+        self.thumbnail_ready.disconnect(update)
 
         # Réactiver les sons Windows
         try:
@@ -1041,114 +1762,65 @@ class SprayPaintApp(QMainWindow):
         except:
             pass
 
-        if file_path:
-            try:
-                img = Image.open(file_path).convert('RGBA')
-                img = img.resize((1920, 1080), Image.Resampling.LANCZOS)
-                self.background_image = img
+        return picker.selected_path if accepted else None
 
-                self.reload_background_layers()
-                self.save_state()  # Sauvegarder après le chargement
-                # Pas de message de succès pour éviter le bruit Windows
-            except Exception as e:
-                self.show_message("Erreur", f"Impossible de charger l'image:\n{e}", QMessageBox.Critical)
+    def load_background_file(self, file_path):
+        """Décoder un fond en arrière-plan (ou le relire du cache), puis l'afficher"""
+        self.background_request = file_path
+        self.canvas.set_status("Chargement du fond...")
+        loader = self.start_asset_loader(lambda: self.engine.decode_background(file_path, self.asset_cache))
+        loader.loaded.connect(lambda image: self.background_loaded(file_path, image))
+        loader.failed.connect(lambda message: self.asset_load_failed(message))
+
+    def background_loaded(self, file_path, image):
+        """Fond décodé : l'afficher, sauf si un autre fond a été demandé entre-temps"""
+        if file_path != self.background_request:
+            return
+        self.engine.set_background(image)
+        self.reload_background_layers()
+        # Pas de message de succès pour éviter le bruit Windows
+        self.canvas.set_status(None)
+
+    def start_asset_loader(self, load):
+        """Lancer load() dans un thread de basse priorité, gardé jusqu'à sa fin"""
+        loader = AssetLoader(load)
+        loader.finished.connect(lambda: self.asset_loaders.remove(loader))
+        self.asset_loaders.append(loader)
+        loader.start(QThread.LowPriority)
+        return loader
+
+    def asset_load_failed(self, message):
+        self.canvas.set_status(None)
+        self.show_message("Erreur", f"Impossible de charger l'image:\n{message}", QMessageBox.Critical)
 
     def load_template(self):
         """Charger une image modèle"""
-        # Créer le dossier /modeles s'il n'existe pas
-        modeles_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modeles")
-        os.makedirs(modeles_dir, exist_ok=True)
-
-        try:
-            import ctypes
-            ctypes.windll.user32.SystemParametersInfoW(0x0002, 0, 0, 0)
-        except:
-            pass
-
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Choisir une image modèle",
-            modeles_dir, "Images (*.png *.jpg *.jpeg *.bmp)"
-        )
-
-        try:
-            import ctypes
-            ctypes.windll.user32.SystemParametersInfoW(0x0002, 1, 0, 0)
-        except:
-            pass
-
+        file_path = self.choose_asset('modeles', "Choisir une image modèle", "Images (*.png *.jpg *.jpeg *.bmp)")
         if file_path:
-            try:
-                img = Image.open(file_path).convert('RGBA')
-                img = img.resize((1000, 1000), Image.Resampling.LANCZOS)
-
-                # Extraire automatiquement le contenu en supprimant le fond
-                img_array = np.array(img)
-
-                # Détecter le fond (couleur dominante dans les coins)
-                corners = [
-                    img_array[0:10, 0:10],  # Haut gauche
-                    img_array[0:10, -10:],  # Haut droit
-                    img_array[-10:, 0:10],  # Bas gauche
-                    img_array[-10:, -10:]  # Bas droit
-                ]
-
-                # Calculer la couleur moyenne des coins (c'est généralement le fond)
-                corner_pixels = np.concatenate([c.reshape(-1, 4) for c in corners])
-                bg_color = np.median(corner_pixels, axis=0).astype(int)
-
-                # Créer un masque pour isoler le contenu
-                # Pixels similaires au fond deviennent transparents
-                diff = np.abs(img_array.astype(int) - bg_color)
-                # Seuil de différence (ajustable)
-                threshold = 50
-                is_background = np.all(diff[:, :, :3] < threshold, axis=2)
-
-                # Appliquer le masque
-                img_array[:, :, 3] = np.where(is_background, 0, img_array[:, :, 3])
-
-                # Recréer l'image
-                img = Image.fromarray(img_array, 'RGBA')
-
-                # Appliquer 60% d'opacité au contenu restant (au lieu de 30%)
-                alpha = img.split()[3]
-                alpha = ImageEnhance.Brightness(alpha).enhance(0.6)
-                img.putalpha(alpha)
-
-                self.template_image = img
-                self.reload_background_layers()
-                self.save_state()  # Sauvegarder après le chargement
-                # Pas de message de succès pour éviter le bruit Windows
-            except Exception as e:
-                self.show_message("Erreur", f"Impossible de charger l'image modèle:\n{e}", QMessageBox.Critical)
+            self.load_template_file(file_path)
+
+    def load_template_file(self, file_path):
+        """Extraire un modèle en arrière-plan (ou le relire du cache), puis l'afficher"""
+        self.template_request = file_path
+        self.canvas.set_status("Chargement du modèle...")
+        loader = self.start_asset_loader(
+            lambda: self.engine.decode_template(file_path, self.asset_cache, self.template_flood_fill))
+        loader.loaded.connect(lambda image: self.template_loaded(file_path, image))
+        loader.failed.connect(lambda message: self.asset_load_failed(message))
+
+    def template_loaded(self, file_path, image):
+        """Modèle extrait : l'afficher, sauf si un autre modèle a été demandé entre-temps"""
+        if file_path != self.template_request:
+            return
+        self.engine.set_template(image)
+        self.reload_background_layers()
+        # Pas de message de succès pour éviter le bruit Windows
+        self.canvas.set_status(None)
 
     def reload_background_layers(self):
         """Recharger toutes les couches en préservant le dessin"""
-        # Toujours créer un fond blanc
-        base = Image.new('RGBA', (1920, 1080), (255, 255, 255, 255))
-
-        if self.background_image:
-            base = Image.alpha_composite(base, self.background_image)
-
-        # Le modèle est collé avec alpha compositing pour gérer la transparence
-        if self.template_image:
-            x = self.template_position[0] - 500
-            y = self.template_position[1] - 500
-            # Créer une image temporaire pour placer le modèle
-            temp_layer = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-            temp_layer.paste(self.template_image, (x, y), self.template_image)
-            base = Image.alpha_composite(base, temp_layer)
-
-        # Ajouter le dessin par-dessus si il existe
-        if self.drawing_layer is not None:
-            base = Image.alpha_composite(base, self.drawing_layer)
-
-        # Convertir en QImage
-        img_data = base.tobytes("raw", "RGBA")
-        qimage = QImage(img_data, 1920, 1080, QImage.Format_RGBA8888)
-        self.canvas.image = qimage.copy()
-
-        # NE PAS sauvegarder l'état ici - cela cause des problèmes avec l'historique
-        self.canvas.update()
+        width, height = self.engine.size
+        self.refresh_canvas_region((0, 0, width, height))
 
     def load_sound(self):
         """Charger un son"""
@@ -1158,27 +1830,7 @@ class SprayPaintApp(QMainWindow):
                               QMessageBox.Warning)
             return
 
-        # Créer le dossier /sons s'il n'existe pas
-        sons_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sons")
-        os.makedirs(sons_dir, exist_ok=True)
-
-        try:
-            import ctypes
-            ctypes.windll.user32.SystemParametersInfoW(0x0002, 0, 0, 0)
-        except:
-            pass
-
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Choisir un son de spray",
-            sons_dir, "Audio (*.wav *.mp3 *.ogg)"
-        )
-
-        try:
-            import ctypes
-            ctypes.windll.user32.SystemParametersInfoW(0x0002, 1, 0, 0)
-        except:
-            pass
-
+        file_path = self.choose_asset('sons', "Choisir un son de spray", "Audio (*.wav *.mp3 *.ogg)")
         if file_path:
             try:
                 self.spray_sound = pygame.mixer.Sound(file_path)
@@ -1197,37 +1849,13 @@ class SprayPaintApp(QMainWindow):
             # Récupérer les options
             include_bg = dialog.include_background.isChecked()
             include_tpl = dialog.include_template.isChecked()
+            png_compression = dialog.png_compression.currentData()
 
-            # Composer l'image finale selon les options
-            # Si on n'inclut pas le fond, créer un fond transparent pour avoir juste le dessin
-            if not include_bg:
-                final_image = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-            else:
-                final_image = Image.new('RGBA', (1920, 1080), (255, 255, 255, 255))
-
-            # Ajouter le fond si demandé
-            if include_bg and self.background_image:
-                final_image = Image.alpha_composite(final_image, self.background_image)
-
-            # Ajouter le modèle si demandé
-            if include_tpl and self.template_image:
-                tx = self.template_position[0] - 500
-                ty = self.template_position[1] - 500
-                # Créer une image temporaire pour placer le modèle
-                temp_layer = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-                temp_layer.paste(self.template_image, (tx, ty), self.template_image)
-                final_image = Image.alpha_composite(final_image, temp_layer)
-
-            # Toujours ajouter le dessin (qui est déjà isolé dans drawing_layer)
-            if self.drawing_layer:
-                final_image = Image.alpha_composite(final_image, self.drawing_layer)
-
-            # Convertir en RGB pour la sauvegarde (sauf si fond transparent)
-            if not include_bg:
-                # Garder le PNG avec transparence
-                pass
-            else:
-                final_image = final_image.convert('RGB')
+            # Figer les couches correspondant aux options (fond transparent sans l'image de fond, pour
+            # avoir juste le dessin) : seul le dessin est copié, la composition et l'encodage se font
+            # ensuite en arrière-plan, sans bloquer la peinture
+            with self.engine.layer_lock:
+                snapshot = self.engine.snapshot(include_bg, include_tpl)
 
             # Désactiver les sons Windows
             try:
@@ -1237,12 +1865,12 @@ class SprayPaintApp(QMainWindow):
                 pass
 
             # Adapter les formats disponibles selon si on a de la transparence
-            if not include_bg:
-                file_formats = "PNG (*.png)"
-            else:
-                file_formats = "PNG (*.png);;JPEG (*.jpg)"
+            # (WebP sans perte : plus rapide à encoder et plus compact que le PNG)
+            file_formats = "PNG (*.png);;WebP sans perte (*.webp)"
+            if include_bg:
+                file_formats += ";;JPEG (*.jpg)"
 
-            file_path, _ = QFileDialog.getSaveFileName(
+            file_path, selected_filter = QFileDialog.getSaveFileName(
                 self, "Sauvegarder l'image",
                 save_dir, file_formats
             )
@@ -1255,11 +1883,30 @@ class SprayPaintApp(QMainWindow):
                 pass
 
             if file_path:
-                try:
-                    final_image.save(file_path)
-                    # Pas de message de succès pour éviter le bruit Windows
-                except Exception as e:
-                    self.show_message("Erreur", f"Impossible de sauvegarder:\n{e}", QMessageBox.Critical)
+                if not os.path.splitext(file_path)[1]:
+                    # Extension du format choisi (le format est déduit de l'extension)
+                    file_path += selected_filter.split("(*")[-1].rstrip(")")
+                self.start_image_save(snapshot, file_path, include_bg, png_compression)
+
+    def start_image_save(self, snapshot, file_path, opaque, png_compression=6):
+        """Lancer la composition et l'encodage d'un instantané dans un thread de basse priorité"""
+        saver = ImageSaver(snapshot, file_path, opaque, png_compression)
+        saver.progress.connect(lambda percent, step: self.canvas.set_status(f"Sauvegarde : {step}", percent))
+        saver.saved.connect(self.image_saved)
+        saver.failed.connect(self.image_save_failed)
+        saver.finished.connect(lambda: self.image_savers.remove(saver))
+        self.image_savers.append(saver)
+        saver.start(QThread.LowPriority)
+        return saver
+
+    def image_saved(self, file_path, seconds):
+        """Sauvegarde terminée (pas de message de succès pour éviter le bruit Windows)"""
+        print(f"Image sauvegardée : {file_path} ({seconds:.2f} s)")
+        self.canvas.set_status("Image sauvegardée", 100, hide_after=2000)
+
+    def image_save_failed(self, file_path, message):
+        self.canvas.set_status(None)
+        self.show_message("Erreur", f"Impossible de sauvegarder:\n{message}", QMessageBox.Critical)
 
     def toggle_eraser(self):
         """Activer/désactiver la gomme"""
@@ -1296,24 +1943,27 @@ class SprayPaintApp(QMainWindow):
 
     def undo(self):
         """Annuler"""
-        if len(self.history) > 1:
-            # Retirer l'état actuel
-            self.history.pop()
-            # Récupérer l'état précédent
-            canvas_image, drawing_layer = self.history[-1]
-            self.canvas.image = canvas_image.copy()
-            if drawing_layer:
-                self.drawing_layer = drawing_layer.copy()
-            self.canvas.update()
+        # Le thread de rendu rejoue l'historique et ne recomposera que la zone du trait annulé
+        if not self.canvas.drawing:
+            if self.input_recorder.recording:
+                self.input_recorder.record_action('undo')
+            self.render_worker.submit(('undo',))
+
+    def redo(self):
+        """Rétablir"""
+        if not self.canvas.drawing:
+            if self.input_recorder.recording:
+                self.input_recorder.record_action('redo')
+            self.render_worker.submit(('redo',))
 
     def restart_with_background(self):
         """Recommencer"""
         if self.show_question("Confirmation",
                               "Recommencer le dessin en gardant le fond et le modèle ?"):
-            # Réinitialiser uniquement la couche de dessin
-            self.drawing_layer = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-            self.reload_background_layers()
-            self.save_state()  # Sauvegarder après le restart
+            # Réinitialiser uniquement la couche de dessin (commande annulable comme un trait)
+            if self.input_recorder.recording:
+                self.input_recorder.record_action('clear')
+            self.render_worker.submit(('clear',))
 
     def decrease_size(self):
         """Diminuer la taille"""
@@ -1345,18 +1995,22 @@ class SprayPaintApp(QMainWindow):
         """Sélectionner une couleur"""
         self.spray_color = color
 
-    def save_state(self):
-        """Sauvegarder l'état (canvas + couche de dessin)"""
-        if len(self.history) >= self.max_history:
-            self.history.pop(0)
-        # Sauvegarder à la fois l'image canvas et la couche de dessin
-        drawing_copy = self.drawing_layer.copy() if self.drawing_layer else None
-        self.history.append((self.canvas.image.copy(), drawing_copy))
+    def save_state(self, pos):
+        """Commencer dans le moteur le trait qui démarre en pos (enregistré dans l'historique)"""
+        self.render_worker.submit(('begin', {
+            'x': pos.x(), 'y': pos.y(),
+            'color': self.spray_color,
+            'size': self.spray_size,
+            'opacity': self.spray_opacity,
+            'eraser': self.eraser_mode,
+        }))
 
     def start_spray(self, pos):
         """Démarrer le spray"""
         self.last_valid_position = pos
-        self.save_state()
+        self.pending_points = []
+        self.save_state(pos)
+        self.frame_timer.start()
 
         if self.pygame_available and self.spray_sound and not self.eraser_mode:
             try:
@@ -1364,8 +2018,29 @@ class SprayPaintApp(QMainWindow):
             except Exception as e:
                 print(f"Erreur lors de la lecture du son: {e}")
 
-    def spray_paint(self, pos):
-        """Appliquer le spray"""
+    def queue_spray_point(self, pos, timestamp):
+        """Mettre en file une position du stylet, dessinée à la prochaine image"""
+        self.profiler.input_event(timestamp)
+        self.pending_points.append((pos, timestamp))
+
+    def render_frame(self, force=False):
+        """Dessiner en un seul lot toutes les positions reçues depuis la dernière image
+
+        Tant que le lot précédent est en cours de rendu, les positions restent en file et rejoindront
+        le lot suivant : le trait ne prend pas de retard sur le stylet. force envoie quand même le lot
+        (fin du trait, rejeu).
+        """
+        if not self.pending_points:
+            return
+        if not force and self.render_worker.batch_in_flight():
+            return
+        points, self.pending_points = self.pending_points, []
+        if self.input_recorder.recording:
+            self.input_recorder.record_frame()
+        self.spray_paint([pos for pos, _ in points], [timestamp for _, timestamp in points])
+
+    def is_valid_spray_position(self, pos):
+        """Vérifier que le stylet a réellement bougé (sinon son seulement)"""
         # Détection de position valide
         if self.last_valid_position:
             dx = abs(pos.x() - self.last_valid_position.x())
@@ -1386,133 +2061,58 @@ class SprayPaintApp(QMainWindow):
                         self.sound_channel = self.spray_sound.play(loops=-1)
                     except Exception as e:
                         print(f"Erreur lors de la lecture du son: {e}")
-                return
+                return False
             else:
                 # Position détectée correctement, réinitialiser le compteur
                 if self.position_not_detected_count > 0:
                     print("✓ Position du stylet détectée correctement!")
                     self.position_not_detected_count = 0
 
-        self.last_valid_position = pos
-
-        x, y = pos.x(), pos.y()
-
-        if self.eraser_mode:
-            # Gomme: effacer sur la couche de dessin
-            mask = Image.new('L', (1920, 1080), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.ellipse([x - self.spray_size, y - self.spray_size,
-                               x + self.spray_size, y + self.spray_size], fill=255)
-
-            # Créer une image transparente
-            transparent = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-
-            # Appliquer le masque pour effacer la zone sur la couche de dessin
-            self.drawing_layer = Image.composite(transparent, self.drawing_layer, mask)
-        else:
-            # Spray réaliste ultra amélioré
-            spray_layer = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-            spray_draw = ImageDraw.Draw(spray_layer)
-
-            rgb_color = tuple(int(self.spray_color.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4))
-
-            # Nombre de particules ajusté pour éviter un centre trop dense
-            num_particles = int(self.spray_size * 6)
-
-            for _ in range(num_particles):
-                # Distribution ajustée :
-                # 50% des particules au centre (au lieu de 60%)
-                # 35% des particules en zone intermédiaire (au lieu de 30%)
-                # 15% des particules très éloignées (au lieu de 10%)
-                rand = random.random()
-
-                if rand < 0.5:
-                    # Zone centrale - distribution légèrement plus large
-                    offset_x = int(random.gauss(0, self.spray_size / 3.5))
-                    offset_y = int(random.gauss(0, self.spray_size / 3.5))
-                elif rand < 0.85:
-                    # Zone intermédiaire
-                    offset_x = int(random.gauss(0, self.spray_size / 1.8))
-                    offset_y = int(random.gauss(0, self.spray_size / 1.8))
-                else:
-                    # Particules très éloignées (projections)
-                    offset_x = int(random.gauss(0, self.spray_size * 1.5))
-                    offset_y = int(random.gauss(0, self.spray_size * 1.5))
-
-                distance = (offset_x ** 2 + offset_y ** 2) ** 0.5
-
-                # Limite plus souple pour permettre aux particules d'aller plus loin
-                if distance <= self.spray_size * 2:
-                    px = x + offset_x
-                    py = y + offset_y
-
-                    # Tailles de particules très variées
-                    particle_rand = random.random()
-                    if particle_rand < 0.75:
-                        # 75% de très petites particules (1 pixel)
-                        particle_size = 0.5
-                    elif particle_rand < 0.92:
-                        # 17% de petites particules (2 pixels)
-                        particle_size = 1
-                    else:
-                        # 8% de particules moyennes (3-4 pixels)
-                        particle_size = random.uniform(1.5, 2.5)
-
-                    # Opacité basée sur la distance avec courbe plus douce
-                    if distance < self.spray_size * 0.3:
-                        # Centre - opacité réduite pour moins de densité
-                        base_opacity = random.uniform(0.6, 0.9)
-                    elif distance < self.spray_size:
-                        # Zone intermédiaire
-                        distance_factor = 1 - (distance / self.spray_size)
-                        base_opacity = distance_factor ** 1.5 * random.uniform(0.4, 0.9)
-                    else:
-                        # Zone éloignée, très transparent
-                        distance_factor = 1 - (distance / (self.spray_size * 2))
-                        base_opacity = distance_factor ** 3 * random.uniform(0.1, 0.4)
-
-                    final_opacity = int(255 * base_opacity * (self.spray_opacity / 100.0))
-
-                    # Limiter l'opacité pour éviter les pixels complètement opaques
-                    final_opacity = min(final_opacity, 200)
+        return True
 
-                    color_with_opacity = rgb_color + (final_opacity,)
+    def spray_paint(self, points, timestamps=None):
+        """Appliquer le spray sur une suite de positions"""
+        if timestamps is None:
+            timestamps = [0] * len(points)
 
-                    if 0 <= px < 1920 and 0 <= py < 1080:
-                        spray_draw.ellipse(
-                            [px - particle_size, py - particle_size,
-                             px + particle_size, py + particle_size],
-                            fill=color_with_opacity
-                        )
+        # Seules les positions où le stylet a réellement bougé sont envoyées au moteur, en un seul lot
+        frame = []
+        for pos, timestamp in zip(points, timestamps):
+            if self.is_valid_spray_position(pos):
+                frame.append((pos.x(), pos.y(), timestamp))
+                self.last_valid_position = pos
+        if frame:
+            # Le plus ancien événement du lot sert à mesurer la latence jusqu'à l'affichage
+            event = min(timestamps) if any(timestamps) else None
+            self.render_worker.submit(('points', frame, {'event': event}))
 
-            # Ajouter le spray à la couche de dessin
-            self.drawing_layer = Image.alpha_composite(self.drawing_layer, spray_layer)
+    def refresh_canvas_region(self, box):
+        """Demander au thread de rendu de recomposer et d'afficher la boîte donnée"""
+        self.render_worker.submit(('refresh', box))
 
-        # Recomposer l'image complète : fond + modèle + dessin
-        final_image = Image.new('RGBA', (1920, 1080), (255, 255, 255, 255))
+    def present_region(self, box):
+        """Recomposer une zone en place dans le double tampon du canvas (thread de rendu)
 
-        if self.background_image:
-            final_image = Image.alpha_composite(final_image, self.background_image)
-
-        # Le modèle est collé avec alpha compositing pour gérer la transparence
-        if self.template_image:
-            tx = self.template_position[0] - 500
-            ty = self.template_position[1] - 500
-            # Créer une image temporaire pour placer le modèle
-            temp_layer = Image.new('RGBA', (1920, 1080), (0, 0, 0, 0))
-            temp_layer.paste(self.template_image, (tx, ty), self.template_image)
-            final_image = Image.alpha_composite(final_image, temp_layer)
+        Retourne les durées (ms) de composition et de publication (échange des tampons).
+        """
+        start = time.perf_counter()
+        composed = []
 
-        # Ajouter le dessin par-dessus
-        final_image = Image.alpha_composite(final_image, self.drawing_layer)
+        def render(target):
+            self.engine.render_region(box, target)
+            composed.append(time.perf_counter())
 
-        # Reconvertir en QImage
-        img_data = final_image.tobytes("raw", "RGBA")
-        self.canvas.image = QImage(img_data, 1920, 1080, QImage.Format_RGBA8888).copy()
-        self.canvas.update()
+        self.canvas.publish_region(box, render)
+        end = time.perf_counter()
+        return (composed[0] - start) * 1000, (end - composed[0]) * 1000
 
     def stop_spray(self):
         """Arrêter le spray"""
+        # Dessiner les dernières positions reçues avant d'arrêter l'horloge
+        self.frame_timer.stop()
+        self.render_frame(force=True)
+        self.render_worker.submit(('end',))
+
         if self.sound_channel:
             try:
                 self.sound_channel.stop()
@@ -1532,9 +2132,151 @@ class SprayPaintApp(QMainWindow):
                     except:
                         pass
                 self.close()
+        elif event.key() == Qt.Key_Z and event.modifiers() & Qt.ControlModifier:
+            self.undo()
+        elif event.key() == Qt.Key_Y and event.modifiers() & Qt.ControlModifier:
+            self.redo()
+        elif event.key() == Qt.Key_F3:
+            self.toggle_hud()
+        elif event.key() == Qt.Key_F4:
+            self.export_frame_stats()
+        elif event.key() == Qt.Key_F5:
+            self.toggle_input_recording()
+        elif event.key() == Qt.Key_F6:
+            self.choose_replay(max_speed=bool(event.modifiers() & Qt.ShiftModifier))
+
+    def toggle_hud(self):
+        """Afficher/masquer les mesures de performance sur le canvas"""
+        self.profiler.visible = not self.profiler.visible
+        if self.profiler.visible:
+            self.hud_timer.start()
+        else:
+            self.hud_timer.stop()
+        self.canvas.update(self.canvas.hud_rect)
+
+    def export_frame_stats(self):
+        """Écrire les mesures par image dans /save, au format CSV"""
+        save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "save")
+        os.makedirs(save_dir, exist_ok=True)
+        path = os.path.join(save_dir, f"mesures_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+        try:
+            self.profiler.export_csv(path)
+            print(f"Mesures exportées : {path}")
+        except Exception as e:
+            print(f"Erreur lors de l'export des mesures: {e}")
+
+    def toggle_input_recording(self):
+        """Commencer/terminer l'enregistrement des événements du stylet (fichier dans /save)"""
+        if self.input_recorder.recording:
+            save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "save")
+            os.makedirs(save_dir, exist_ok=True)
+            path = os.path.join(save_dir, f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}.rec.gz")
+            try:
+                count = self.input_recorder.stop(path)
+                print(f"Enregistrement terminé : {path} ({count} événements)")
+            except Exception as e:
+                print(f"Erreur lors de l'écriture de l'enregistrement: {e}")
+        elif self.canvas.drawing or (self.replayer and self.replayer.running):
+            print("Enregistrement impossible pendant un trait ou un rejeu")
+        else:
+            self.input_recorder.start(self)
+            print("Enregistrement des événements du stylet (F5 pour terminer)")
+
+    def choose_replay(self, max_speed=False):
+        """Choisir un enregistrement et le rejouer (Maj+F6 : à vitesse maximale)"""
+        if self.input_recorder.recording or self.canvas.drawing or (self.replayer and self.replayer.running):
+            return
+        save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "save")
+        path, _ = QFileDialog.getOpenFileName(self, "Rejouer un enregistrement", save_dir,
+                                              "Enregistrements (*.rec.gz)")
+        if path:
+            self.replay(path, max_speed)
+
+    def replay(self, path, max_speed=False, on_finished=None):
+        """Rejouer un enregistrement dans le canvas"""
+        try:
+            self.replayer = InputReplayer(self, path, max_speed, on_finished)
+        except Exception as e:
+            print(f"Erreur lors de la lecture de l'enregistrement: {e}")
+            return None
+        self.replayer.start()
+        return self.replayer
+
+    def start_autosave(self):
+        """Proposer de restaurer la session précédente, puis démarrer la sauvegarde automatique"""
+        payloads = {}
+        if os.path.exists(self.autosave_path):
+            try:
+                size, tile_size, payloads = SessionStore.read(self.autosave_path)
+            except Exception as e:
+                print(f"Erreur lors de la lecture de la session précédente: {e}")
+                payloads = {}
+            if payloads and (size != self.engine.size or tile_size != self.engine.brush.TILE_SIZE):
+                print(f"Session précédente en {size[0]}x{size[1]}, non restaurée")
+                payloads = {}
+
+            if payloads and self.show_question("Session précédente",
+                                               "Reprendre le dessin de la session précédente ?"):
+                start = time.perf_counter()
+                tiles = SessionStore.decode_tiles(payloads, size, tile_size)
+                self.render_worker.wait_idle()
+                with self.engine.layer_lock:
+                    self.engine.restore_tiles(tiles)
+                self.refresh_canvas_region((0, 0) + self.engine.size)
+                print(f"Session restaurée ({len(tiles)} tuiles, {(time.perf_counter() - start) * 1000:.0f} ms)")
+            else:
+                # Session illisible, d'une autre taille ou refusée : gardée une dernière fois à côté, au cas où
+                try:
+                    os.replace(self.autosave_path, self.autosave_path + ".prec")
+                except OSError as e:
+                    print(f"Erreur lors de la mise de côté de la session précédente: {e}")
+                payloads = {}
+
+        try:
+            os.makedirs(os.path.dirname(self.autosave_path), exist_ok=True)
+            self.session_store = SessionStore(self.autosave_path, self.engine.size)
+            self.session_store.start(payloads)
+        except Exception as e:
+            print(f"Erreur lors de la création de la sauvegarde automatique: {e}")
+            self.session_store = None
+            return
+        self.autosave_timer.start()
+
+    def autosave(self):
+        """Écrire en arrière-plan les tuiles modifiées depuis la dernière sauvegarde automatique"""
+        if self.autosave_thread and self.autosave_thread.is_alive():
+            return
+        self.autosave_thread = threading.Thread(target=self.write_autosave, daemon=True)
+        self.autosave_thread.start()
+
+    def write_autosave(self):
+        """Copier les tuiles modifiées sous le verrou des couches, puis les compresser et les écrire"""
+        with self.engine.layer_lock:
+            tiles = self.engine.capture_dirty_tiles()
+        try:
+            self.session_store.write_tiles(tiles)
+        except Exception as e:
+            print(f"Erreur lors de la sauvegarde automatique: {e}")
+            # Tuiles réécrites à la prochaine sauvegarde
+            with self.engine.layer_lock:
+                self.engine.dirty_tiles.update((tx, ty) for tx, ty, _ in tiles)
 
     def closeEvent(self, event):
         """Gérer la fermeture de la fenêtre"""
+        if self.input_recorder.recording:
+            self.toggle_input_recording()
+        self.asset_index.shutdown()
+        # Laisser les sauvegardes et décodages en cours se terminer
+        for thread in self.image_savers + self.asset_loaders:
+            thread.wait()
+        if self.render_worker:
+            self.render_worker.stop()
+        # Dernière sauvegarde automatique, une fois tous les traits dessinés
+        if self.session_store:
+            self.autosave_timer.stop()
+            if self.autosave_thread:
+                self.autosave_thread.join()
+            self.write_autosave()
         if self.pygame_available:
             try:
                 pygame.mixer.quit()
@@ -1545,12 +2287,19 @@ class SprayPaintApp(QMainWindow):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Spray Paint Interactive")
+    parser.add_argument("--replay", metavar="FICHIER", help="rejouer un enregistrement (.rec.gz) puis quitter")
+    parser.add_argument("--max-speed", action="store_true", help="rejouer à vitesse maximale")
+    parser.add_argument("--output", metavar="IMAGE", help="après le rejeu, enregistrer l'image composée")
+    args, qt_args = parser.parse_known_args()
+
     print("Démarrage de l'application...")
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     print("QApplication créée")
 
     try:
-        window = SprayPaintApp()
+        # Un rejeu ne doit ni proposer ni écraser la session sauvegardée
+        window = SprayPaintApp(autosave=not args.replay)
         print("Fenêtre créée")
         window.show()
         print("Fenêtre affichée")
@@ -1562,6 +2311,17 @@ def main():
         traceback.print_exc()
         return
 
+    if args.replay:
+        def replay_finished(replayer):
+            if args.output:
+                with window.engine.layer_lock:
+                    window.engine.compose_image().save(args.output)
+                print(f"Image enregistrée : {args.output}")
+            app.quit()
+
+        # Laisser la fenêtre s'afficher et les barres se placer avant le premier événement
+        QTimer.singleShot(500, lambda: window.replay(args.replay, args.max_speed, replay_finished) or app.quit())
+
     print("Lancement de la boucle d'événements...")
     sys.exit(app.exec_())
 